@@ -16,16 +16,55 @@
 
 import sys
 import os
+import argparse
+import csv
+import getpass
+import hashlib
+import heapq
+import json
+import logging
+import math
+import queue
+import re
+import sqlite3
+import threading
+import time
+import traceback
+import unicodedata
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from urllib.parse import parse_qs, unquote, urlsplit
+from multiprocessing import freeze_support
+from contextlib import contextmanager
+from datetime import datetime
+from difflib import SequenceMatcher, unified_diff
+# Startup timeline origin; the third-party imports below dominate the import phase
+STARTUP_STARTED = time.perf_counter()
+import numpy as np
 import pandas as pd
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QTextEdit, 
+from openpyxl import Workbook, load_workbook
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet then falls back to whatever engine pandas can find
+    pa = pq = None
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QTextEdit, QPlainTextEdit,
                              QVBoxLayout, QHBoxLayout, QGridLayout, QWidget, 
                              QLabel, QCheckBox, QFileDialog, QMessageBox, QDialog,
                              QLineEdit, QInputDialog, QScrollArea, QFormLayout,
-                             QDialogButtonBox, QAction, QMenu)
-from PyQt5.QtCore import Qt, QSettings, QEvent, QObject, QRect, QPropertyAnimation, QEasingCurve, pyqtProperty, pyqtSignal
+                             QDialogButtonBox, QAction, QMenu, QListWidget, QSplitter, QTreeWidget,
+                             QTreeWidgetItem, QProgressDialog, QComboBox, QSizePolicy)
+from PyQt5.QtCore import (Qt, QSettings, QEvent, QObject, QRect, QPropertyAnimation, QEasingCurve, pyqtProperty, pyqtSignal,
+                          QTimer, QThread)
 from PyQt5.QtGui import QFont, QClipboard, QTextCursor, QIcon, QPainter, QColor, QPen
 import ctypes
 
+STARTUP_IMPORTED = time.perf_counter()
+
 VERSION = "3.0"
 
 def resource_path(relative_path):
@@ -44,6 +83,2124 @@ icon_path = resource_path('AnnotAPP.ico')
 myappid = 'amazon.cdt.annotapp.3.0'
 ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
+# Changed regions up to this many characters are diffed char by char, larger ones line by line
+DELTA_CHAR_DIFF_LIMIT = 4000
+# Above this many lines the diff is skipped and the changed region is stored as a single replace
+DELTA_LINE_DIFF_LIMIT = 20000
+
+def make_text_delta(old, new):
+    """ Compact delta turning old into new: a tuple of (position in old, old segment, new segment) """
+    # Strip the common prefix and suffix so the matcher only sees the changed middle
+    prefix = len(os.path.commonprefix([old, new]))
+    limit = min(len(old), len(new)) - prefix
+    suffix = 0
+    while suffix < limit and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    a = old[prefix:len(old) - suffix]
+    b = new[prefix:len(new) - suffix]
+    if not a or not b:
+        return ((prefix, a, b),) if a or b else ()
+
+    if len(a) + len(b) <= DELTA_CHAR_DIFF_LIMIT:
+        return tuple((prefix + i1, a[i1:i2], b[j1:j2])
+                     for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+                     if tag != 'equal')
+
+    a_lines = a.splitlines(keepends=True)
+    b_lines = b.splitlines(keepends=True)
+    if len(a_lines) + len(b_lines) > DELTA_LINE_DIFF_LIMIT:
+        return ((prefix, a, b),)
+    a_offsets = [0]
+    for line in a_lines:
+        a_offsets.append(a_offsets[-1] + len(line))
+    return tuple((prefix + a_offsets[i1], ''.join(a_lines[i1:i2]), ''.join(b_lines[j1:j2]))
+                 for tag, i1, i2, j1, j2 in SequenceMatcher(None, a_lines, b_lines, autojunk=False).get_opcodes()
+                 if tag != 'equal')
+
+def apply_text_delta(text, delta, reverse=False):
+    """ Apply a delta from make_text_delta to old text, or undo it on new text with reverse=True """
+    parts = []
+    prev = 0
+    shift = 0
+    for pos, old_seg, new_seg in delta:
+        if reverse:
+            pos += shift
+            shift += len(new_seg) - len(old_seg)
+            old_seg, new_seg = new_seg, old_seg
+        parts.append(text[prev:pos])
+        parts.append(new_seg)
+        prev = pos + len(old_seg)
+    parts.append(text[prev:])
+    return ''.join(parts)
+
+def text_size(text):
+    # Rough memory estimate used for undo accounting; non-text cells (NaN, numbers) count as empty
+    if isinstance(text, AnnotationRecord):
+        return 48 + text_size(text.body)
+    if isinstance(text, CompressedText):
+        return len(text.data)
+    return len(text) if isinstance(text, str) else 0
+
+# Bodies of at least this many characters are kept zlib-compressed in memory (0 disables it)
+COMPRESS_THRESHOLD = 64 * 1024
+COMPRESS_LEVEL = 6
+# Leading characters kept uncompressed, enough for tooltips and lists without inflating the body
+COMPRESS_PREVIEW_CHARS = 200
+# Recently shown bodies stay decompressed up to this many characters in total
+DECOMPRESS_CACHE_CHARS = 8 * 1024 * 1024
+
+class CompressedText:
+    __slots__ = ('data', 'length', 'preview')
+
+    def __init__(self, text):
+        self.data = zlib.compress(text.encode('utf-8'), COMPRESS_LEVEL)
+        self.length = len(text)
+        self.preview = text[:COMPRESS_PREVIEW_CHARS]
+
+    def decompress(self):
+        return zlib.decompress(self.data).decode('utf-8')
+
+class AnnotationRecord:
+    # One library entry: the body (str, or CompressedText when large) and its metadata. Records
+    # are replaced rather than changed, so undo records and the store can share them.
+    __slots__ = ('body', 'digest', 'created', 'modified')
+
+    def __init__(self, body, created, modified, digest=None):
+        self.body = body
+        self.digest = digest  # blake2b digest of the body, filled in the first time it is needed
+        self.created = created
+        self.modified = modified
+
+    @property
+    def length(self):
+        if isinstance(self.body, CompressedText):
+            return self.body.length
+        return len(self.body) if isinstance(self.body, str) else 0
+
+# Operation records for the undo stack. Each one is compact and knows how to replay itself
+# against the store in either direction.
+class AddOp:
+    __slots__ = ('name', 'text')
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    @property
+    def size(self):
+        return 64 + text_size(self.text)
+
+    def describe(self):
+        return f"Add '{self.name}'"
+
+    def undo(self, store):
+        store._pop(self.name)
+
+    def redo(self, store):
+        store._put(self.name, self.text)
+
+class RemoveOp(AddOp):
+    __slots__ = ()
+
+    def describe(self):
+        return f"Remove '{self.name}'"
+
+    def undo(self, store):
+        store._put(self.name, self.text)
+
+    def redo(self, store):
+        store._pop(self.name)
+
+class EditOp:
+    __slots__ = ('name', 'delta')
+
+    def __init__(self, name, delta):
+        self.name = name
+        self.delta = delta
+
+    @property
+    def size(self):
+        return 64 + sum(48 + len(old_seg) + len(new_seg) for _, old_seg, new_seg in self.delta)
+
+    def describe(self):
+        return f"Edit '{self.name}'"
+
+    def undo(self, store):
+        store._put(self.name, apply_text_delta(store[self.name], self.delta, reverse=True))
+
+    def redo(self, store):
+        store._put(self.name, apply_text_delta(store[self.name], self.delta))
+
+class ReplaceOp:
+    # Fallback for values that are not plain text (empty cells read back as NaN)
+    __slots__ = ('name', 'old', 'new')
+
+    def __init__(self, name, old, new):
+        self.name = name
+        self.old = old
+        self.new = new
+
+    @property
+    def size(self):
+        return 64 + text_size(self.old) + text_size(self.new)
+
+    def describe(self):
+        return f"Edit '{self.name}'"
+
+    def undo(self, store):
+        store._put(self.name, self.old)
+
+    def redo(self, store):
+        store._put(self.name, self.new)
+
+class RenameOp:
+    __slots__ = ('name', 'new_name')
+
+    def __init__(self, name, new_name):
+        self.name = name
+        self.new_name = new_name
+
+    size = 64
+
+    def describe(self):
+        return f"Rename '{self.name}' to '{self.new_name}'"
+
+    def undo(self, store):
+        store._move(self.new_name, self.name)
+
+    def redo(self, store):
+        store._move(self.name, self.new_name)
+
+class ClearOp:
+    # Keeps the cleared dict itself, so undo and redo are a single swap
+    __slots__ = ('data', 'size')
+
+    def __init__(self, data):
+        self.data = data
+        self.size = 64 + sum(text_size(text) for text in data.values())
+
+    def describe(self):
+        return "Remove All"
+
+    def undo(self, store):
+        store._reset(self.data)
+
+    def redo(self, store):
+        store._reset({})
+
+class CompoundOp:
+    __slots__ = ('label', 'ops', 'size')
+
+    def __init__(self, label, ops):
+        self.label = label
+        self.ops = tuple(ops)
+        self.size = 64 + sum(op.size for op in self.ops)
+
+    def describe(self):
+        return f"{self.label} ({len(self.ops)} changes)"
+
+    def undo(self, store):
+        for op in reversed(self.ops):
+            op.undo(store)
+
+    def redo(self, store):
+        for op in self.ops:
+            op.redo(store)
+
+class UndoStack:
+    def __init__(self, max_bytes=16 * 1024 * 1024, max_entries=200):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._undo = deque()
+        self._redo = []
+        self._bytes = 0
+
+    def push(self, op):
+        for dropped in self._redo:
+            self._bytes -= dropped.size
+        self._redo.clear()
+        self._undo.append(op)
+        self._bytes += op.size
+        self._evict()
+
+    def _evict(self):
+        # Drop the oldest records first, but always keep the newest one undoable
+        while len(self._undo) > 1 and (self._bytes > self.max_bytes or len(self._undo) > self.max_entries):
+            self._bytes -= self._undo.popleft().size
+
+    def undo(self, store):
+        if not self._undo:
+            return None
+        op = self._undo.pop()
+        op.undo(store)
+        self._redo.append(op)
+        return op
+
+    def redo(self, store):
+        if not self._redo:
+            return None
+        op = self._redo.pop()
+        op.redo(store)
+        self._undo.append(op)
+        self._evict()
+        return op
+
+    def undo_label(self):
+        return self._undo[-1].describe() if self._undo else None
+
+    def redo_label(self):
+        return self._redo[-1].describe() if self._redo else None
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._bytes = 0
+
+class ChangeSet:
+    # Net effect of one store transaction, handed to listeners once at commit. A name added and
+    # removed again is not reported and one edited several times is reported once. Entries keep
+    # their record when moved to a new name, which is how a rename is told apart from a removal
+    # plus an unrelated addition. reset means the whole library was swapped (Remove All and its
+    # undo) and the name lists are empty.
+    __slots__ = ('added', 'removed', 'changed', 'renamed', 'reset', '_records', '_unpack')
+
+    def __init__(self, pending, data, reset, unpack):
+        self.added, self.removed, self.changed = [], [], []
+        self.renamed = {}  # old name -> new name
+        self.reset = reset
+        self._records = {}  # name -> (record before, record after)
+        self._unpack = unpack
+        if reset:
+            return
+        for name, old in pending.items():
+            new = data.get(name)
+            if old is new:
+                continue
+            self._records[name] = (old, new)
+            (self.added if old is None else self.removed if new is None else self.changed).append(name)
+        if self.added and self.removed:
+            sources = {id(self._records[name][0]): name for name in self.removed}
+            for name in self.added:
+                source = sources.get(id(self._records[name][1]))
+                if source is not None:
+                    self.renamed[source] = name
+            if self.renamed:
+                targets = set(self.renamed.values())
+                self.added = [name for name in self.added if name not in targets]
+                self.removed = [name for name in self.removed if name not in self.renamed]
+
+    def __bool__(self):
+        return self.reset or bool(self._records)
+
+    def names(self):
+        """ Every name whose entry appeared, disappeared or changed; both names of a rename """
+        return self._records.keys()
+
+    def texts(self, name):
+        """ (old text, new text) for a name from names(); None where there was no entry """
+        return tuple(None if record is None else self._unpack(record.body) for record in self._records[name])
+
+class AnnotationStore(Mapping):
+    # Entries are held as AnnotationRecords; large bodies inside them as CompressedText, inflated
+    # on access. Everything outside the store only ever sees plain strings.
+    def __init__(self, undo_stack=None, compress_threshold=COMPRESS_THRESHOLD):
+        self._data = {}
+        self.compress_threshold = compress_threshold
+        self._cache = OrderedDict()  # CompressedText -> text, least recently used first
+        self._cache_chars = 0
+        self.compress_seconds = 0.0
+        self.decompress_seconds = 0.0
+        self.undo_stack = undo_stack if undo_stack is not None else UndoStack()
+        # Called with a ChangeSet once per transaction; a change made outside one is its own transaction
+        self.listeners = []
+        self.version = 0  # Bumped on every change; the local API uses it as the collection ETag
+        self._group = None
+        self._recording = True
+        self._depth = 0  # Open transactions
+        self._pending = {}  # name -> record before the open transaction touched it
+        self._pending_reset = False
+
+    def __getitem__(self, name):
+        return self._unpack(self._data[name].body, cache=True)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def items(self):
+        # Bulk reads (export, search, indexing) inflate each body once without churning the cache
+        for name, record in list(self._data.items()):
+            yield name, self._unpack(record.body)
+
+    def records(self, names=None):
+        # (name, text, record) for exports that write the metadata as well
+        items = list(self._data.items()) if names is None else [(name, self._data[name]) for name in names]
+        for name, record in items:
+            yield name, self._unpack(record.body), record
+
+    def record(self, name):
+        return self._data[name]
+
+    def preview(self, name):
+        body = self._data[name].body
+        return body.preview if isinstance(body, CompressedText) else body
+
+    def length(self, name):
+        return self._data[name].length
+
+    def hash_of(self, name):
+        # Same value as content_hash(self[name]), computed once per body
+        record = self._data[name]
+        if record.digest is None:
+            record.digest = hashlib.blake2b(str(self._unpack(record.body)).encode('utf-8'), digest_size=12).digest()
+        return record.digest.hex()
+
+    def _pack(self, text):
+        if type(text) is not str or not self.compress_threshold or len(text) < self.compress_threshold:
+            return text
+        start = time.perf_counter()
+        packed = CompressedText(text)
+        self.compress_seconds += time.perf_counter() - start
+        return packed
+
+    def _unpack(self, value, cache=False):
+        if not isinstance(value, CompressedText):
+            return value
+        text = self._cache.get(value)
+        if text is not None:
+            self._cache.move_to_end(value)
+            return text
+        start = time.perf_counter()
+        text = value.decompress()
+        self.decompress_seconds += time.perf_counter() - start
+        if cache and value.length <= DECOMPRESS_CACHE_CHARS:
+            self._cache[value] = text
+            self._cache_chars += value.length
+            while self._cache_chars > DECOMPRESS_CACHE_CHARS:
+                self._cache_chars -= self._cache.popitem(last=False)[0].length
+        return text
+
+    def _uncache(self, value):
+        if isinstance(value, CompressedText) and value in self._cache:
+            del self._cache[value]
+            self._cache_chars -= value.length
+
+    def compression_stats(self):
+        packed = [record.body for record in self._data.values() if isinstance(record.body, CompressedText)]
+        return {
+            'compressed': len(packed),
+            'total': len(self._data),
+            'raw_chars': sum(value.length for value in packed),
+            'compressed_bytes': sum(len(value.data) for value in packed),
+            'compress_seconds': self.compress_seconds,
+            'decompress_seconds': self.decompress_seconds,
+            'cached_chars': self._cache_chars,
+        }
+
+    def set(self, name, text, created=None, modified=None):
+        # created/modified default to now; they are passed when loading or importing stored rows
+        if name not in self._data:
+            self._put(name, text, created, modified)
+            self._record(AddOp(name, self._data[name]))
+            return
+        old = self[name]
+        if old is text:
+            return
+        if isinstance(old, str) and isinstance(text, str):
+            if old == text:
+                return
+            self._put(name, text, created, modified)
+            self._record(EditOp(name, make_text_delta(old, text)))
+        else:
+            self._put(name, text, created, modified)
+            self._record(ReplaceOp(name, old, text))
+
+    def remove(self, name):
+        self._record(RemoveOp(name, self._pop(name)))
+
+    def rename(self, name, new_name):
+        # The record moves as is, so created time, digest and compressed body carry over
+        if new_name in self._data:
+            raise KeyError(f"'{new_name}' already exists")
+        self._move(name, new_name)
+        self._record(RenameOp(name, new_name))
+
+    def clear(self):
+        if self._data:
+            data = self._data
+            self._reset({})
+            self._record(ClearOp(data))
+
+    def _put(self, name, text, created=None, modified=None):
+        # text is either new body text or a whole record coming back from the undo stack
+        old = self._data.get(name)
+        if old is not None:
+            self._uncache(old.body)
+        if isinstance(text, AnnotationRecord):
+            record = text
+        else:
+            modified = modified or time.time()
+            record = AnnotationRecord(self._pack(text), created or (old.created if old else modified), modified)
+        self._data[name] = record
+        self._touch(name, old)
+
+    def _pop(self, name):
+        old = self._data.pop(name)
+        self._uncache(old.body)
+        self._touch(name, old)
+        return old
+
+    def _move(self, name, new_name):
+        with self._batch():
+            self._data[new_name] = self._data[name]
+            self._touch(new_name, None)
+            self._touch(name, self._data.pop(name))
+
+    def _reset(self, data):
+        self._data = data
+        self._cache.clear()
+        self._cache_chars = 0
+        self.version += 1
+        if self._recording:
+            self._pending_reset = True
+            self._notify()
+
+    def _touch(self, name, old):
+        self.version += 1
+        if self._recording:
+            self._pending.setdefault(name, old)
+            self._notify()
+
+    def _notify(self):
+        if self._depth or not (self._pending or self._pending_reset):
+            return
+        changes = ChangeSet(self._pending, self._data, self._pending_reset, self._unpack)
+        self._pending = {}
+        self._pending_reset = False
+        if changes:
+            for listener in self.listeners:
+                listener(changes)
+
+    @contextmanager
+    def _batch(self):
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            self._notify()
+
+    @contextmanager
+    def transaction(self, label):
+        """ Make the changes inside the block one undo record and one notification """
+        outermost = self._group is None
+        if outermost:
+            self._group = []
+        self._depth += 1
+        try:
+            yield
+        finally:
+            if outermost:
+                ops, self._group = self._group, None
+                if len(ops) == 1:
+                    self._record(ops[0])
+                elif ops:
+                    self._record(CompoundOp(label, ops))
+            self._depth -= 1
+            self._notify()
+
+    @contextmanager
+    def recording_suspended(self):
+        # Used while loading from disk, which is neither undoable nor a change listeners should see
+        self._recording = False
+        try:
+            yield
+        finally:
+            self._recording = True
+
+    def _record(self, op):
+        if not self._recording:
+            return
+        if self._group is not None:
+            self._group.append(op)
+        else:
+            self.undo_stack.push(op)
+
+    def undo(self):
+        with self._batch():
+            return self.undo_stack.undo(self)
+
+    def redo(self):
+        with self._batch():
+            return self.undo_stack.redo(self)
+
+# Import/export formats: key -> (file dialog filter, extensions)
+ANNOTATION_FORMATS = {
+    "xlsx": ("Excel files (*.xlsx)", (".xlsx",)),
+    "csv": ("CSV files (*.csv)", (".csv",)),
+    "jsonl": ("JSON Lines files (*.jsonl *.ndjson)", (".jsonl", ".ndjson")),
+    "parquet": ("Parquet files (*.parquet)", (".parquet",)),
+}
+IMPORT_FILTERS = ";;".join(["Annotation files (*.xlsx *.csv *.jsonl *.ndjson *.parquet)"] +
+                           [file_filter for file_filter, _ in ANNOTATION_FORMATS.values()])
+EXPORT_FILTERS = ";;".join(file_filter for file_filter, _ in ANNOTATION_FORMATS.values())
+# Rows per chunk for the streaming readers and writers
+IO_CHUNK_ROWS = 10000
+# Excel's row limit minus the header; larger libraries continue on further sheets
+XLSX_SHEET_ROWS = 1048575
+
+def annotation_format(filepath, selected_filter=""):
+    """ Pick the format from the file extension, falling back to the file dialog filter """
+    ext = os.path.splitext(filepath)[1].lower()
+    for fmt, (file_filter, extensions) in ANNOTATION_FORMATS.items():
+        if ext in extensions:
+            return fmt
+    for fmt, (file_filter, extensions) in ANNOTATION_FORMATS.items():
+        if selected_filter == file_filter:
+            return fmt
+    raise ValueError(f"Unsupported file type '{ext or filepath}'")
+
+COLUMNS = ['Name', 'Annotation', 'Tags', 'Created', 'Modified']
+
+def read_annotation_chunks(filepath, fmt):
+    # Yields DataFrames; text formats are streamed, Parquet is read column-wise batch by batch
+    if fmt == "csv":
+        yield from pd.read_csv(filepath, chunksize=IO_CHUNK_ROWS, dtype=str, keep_default_na=False)
+    elif fmt == "jsonl":
+        with open(filepath, encoding='utf-8') as f:
+            records = []
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+                if len(records) >= IO_CHUNK_ROWS:
+                    yield pd.DataFrame.from_records(records)
+                    records = []
+            if records:
+                yield pd.DataFrame.from_records(records)
+    elif fmt == "parquet":
+        if pq is None:
+            yield pd.read_parquet(filepath)
+            return
+        parquet_file = pq.ParquetFile(filepath)
+        missing = {'Name', 'Annotation'} - set(parquet_file.schema_arrow.names)
+        if missing:
+            raise ValueError("Parquet file must have 'Name' and 'Annotation' columns")
+        columns = [column for column in COLUMNS if column in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=IO_CHUNK_ROWS, columns=columns):
+            yield batch.to_pandas()
+    else:
+        # Large exports are split over several sheets; read every sheet that has the columns.
+        # Rows are streamed from a read-only workbook, so the first chunk arrives early.
+        workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            found = False
+            for sheet in workbook.worksheets:
+                rows = sheet.iter_rows(values_only=True)
+                header = [f"Unnamed: {i}" if cell is None else str(cell) for i, cell in enumerate(next(rows, ()))]
+                if not {'Name', 'Annotation'} <= set(header):
+                    continue
+                found = True
+                width = len(header)
+                chunk = []
+                for row in rows:
+                    chunk.append(row[:width] + (None,) * (width - len(row)))
+                    if len(chunk) >= IO_CHUNK_ROWS:
+                        yield pd.DataFrame.from_records(chunk, columns=header)
+                        chunk = []
+                if chunk:
+                    yield pd.DataFrame.from_records(chunk, columns=header)
+            if not found:
+                yield pd.DataFrame()  # Reported as missing columns by iter_annotation_rows
+        finally:
+            workbook.close()
+
+# Folder import reads these files, handing them to worker processes in batches
+FOLDER_IMPORT_EXTENSIONS = ('.txt', '.md')
+FOLDER_IMPORT_BATCH = 256
+
+def read_text_files(root, relpaths):
+    """ Read, decode and normalize a batch of files; runs in a worker process. Returns the rows and
+    the numbers of files that could not be read and that were empty """
+    rows = []
+    failed = empty = 0
+    for relpath in relpaths:
+        try:
+            with open(os.path.join(root, relpath), 'rb') as f:
+                data = f.read()
+        except OSError:
+            failed += 1
+            continue
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = data.decode('cp1252', errors='replace')
+        text = unicodedata.normalize('NFC', text.replace('\r\n', '\n').replace('\r', '\n')).strip()
+        if text:
+            # The name is the path below the chosen folder, without extension
+            modified = os.path.getmtime(os.path.join(root, relpath))
+            rows.append((os.path.splitext(relpath)[0].replace(os.sep, '/'), text, None, None, modified))
+        else:
+            empty += 1
+    return rows, failed, empty
+
+def parse_tags(cell):
+    # Tags are stored comma separated and compared case-insensitively
+    if cell is None or (not isinstance(cell, (list, tuple)) and pd.isna(cell)):
+        return ()
+    parts = cell if isinstance(cell, (list, tuple)) else str(cell).split(',')
+    return tuple(sorted({part.strip().lower() for part in parts if part.strip()}))
+
+def format_timestamp(timestamp):
+    # Local time to the second, readable in Excel and parsed back by parse_timestamp
+    return None if timestamp is None else datetime.fromtimestamp(timestamp).isoformat(' ', 'seconds')
+
+def parse_timestamp(cell):
+    if cell is None or (not isinstance(cell, str) and pd.isna(cell)):
+        return None
+    try:
+        return datetime.fromisoformat(str(cell).strip()).timestamp()
+    except (ValueError, OverflowError, OSError):
+        return None
+
+def write_xlsx(filepath, rows, rows_per_sheet=XLSX_SHEET_ROWS):
+    """ Stream rows into a write-only workbook, so memory use does not grow with the library """
+    workbook = Workbook(write_only=True)
+    sheet = None
+    count = rows_per_sheet
+    for row in rows:
+        if count >= rows_per_sheet:
+            sheet = workbook.create_sheet("Annotations" if sheet is None else f"Annotations {len(workbook.sheetnames) + 1}")
+            sheet.append(COLUMNS)
+            count = 0
+        sheet.append(list(row))
+        count += 1
+    if sheet is None:
+        workbook.create_sheet("Annotations").append(COLUMNS)
+    workbook.save(filepath)
+
+def iter_annotation_rows(filepath, fmt):
+    """ Validated (name, annotation, tags, created, modified) rows from any supported file; tags is None
+    without a Tags column, and the timestamps are None where the file has none """
+    for chunk in read_annotation_chunks(filepath, fmt):
+        if 'Name' not in chunk.columns or 'Annotation' not in chunk.columns:
+            raise ValueError("File must have 'Name' and 'Annotation' columns")
+        missing = [None] * len(chunk)
+        tags_column = chunk['Tags'] if 'Tags' in chunk.columns else missing
+        created_column = chunk['Created'] if 'Created' in chunk.columns else missing
+        modified_column = chunk['Modified'] if 'Modified' in chunk.columns else missing
+        for name, annotation, tags, created, modified in zip(chunk['Name'], chunk['Annotation'], tags_column,
+                                                             created_column, modified_column):
+            if pd.isna(name) or not str(name).strip():
+                continue  # A row without a name cannot become a button
+            yield (str(name), "" if pd.isna(annotation) else str(annotation),
+                   None if 'Tags' not in chunk.columns else parse_tags(tags),
+                   parse_timestamp(created), parse_timestamp(modified))
+
+def annotation_rows(store, tags_of, names=None):
+    """ Rows for write_annotations/write_xlsx, in the store's order or for the given names """
+    for name, annotation, record in store.records(names):
+        yield (name, annotation, ", ".join(tags_of(name)),
+               format_timestamp(record.created), format_timestamp(record.modified))
+
+def write_annotations(filepath, fmt, rows):
+    """ Write rows shaped like COLUMNS; CSV and JSON Lines are written row by row """
+    if fmt == "csv":
+        with open(filepath, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+    elif fmt == "jsonl":
+        with open(filepath, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+                f.write('\n')
+    elif fmt == "parquet" and pq is not None:
+        schema = pa.schema([(column, pa.string()) for column in COLUMNS])
+        with pq.ParquetWriter(filepath, schema) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= IO_CHUNK_ROWS:
+                    writer.write_table(pa.table(list(map(list, zip(*batch))), schema=schema))
+                    batch = []
+            if batch:
+                writer.write_table(pa.table(list(map(list, zip(*batch))), schema=schema))
+    elif fmt == "parquet":
+        pd.DataFrame(list(rows), columns=COLUMNS).to_parquet(filepath, index=False)
+    else:
+        write_xlsx(filepath, rows)
+
+# A sharded library is a directory of JSON Lines shards plus a manifest, used in place of a workbook
+SHARDED_SUFFIX = ".annotlib"
+SHARD_MANIFEST = "manifest.json"
+SHARD_TARGET_ROWS = 4000
+# Below this many bytes of shards, parsing them in the loader thread beats starting worker processes
+SHARD_PARALLEL_BYTES = 8 * 1024 * 1024
+
+def is_sharded_library(path):
+    return os.path.isdir(path)
+
+def shard_count_for(rows):
+    # Fixed when the library is created; a power of two between 16 and 4096
+    count = 16
+    while count < 4096 and count * SHARD_TARGET_ROWS < rows:
+        count *= 2
+    return count
+
+def read_shard(path):
+    """ All rows of one shard; runs in a worker process for large libraries """
+    if not os.path.exists(path):
+        return []
+    return list(iter_annotation_rows(path, "jsonl"))
+
+def write_file_atomic(path, write):
+    # write(tmp_path) fills a temporary file that then replaces path in one step
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+class ShardedLibrary:
+    # A name always lives in shard crc32(name) % count, so a change only dirties its own shard
+    # and a save rewrites just those. Each shard and the manifest are replaced atomically.
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, SHARD_MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != 'annotapp-shards' or manifest.get('version') != 1:
+            raise ValueError(f"'{path}' is not a sharded annotation library")
+        self.count = manifest['shards']
+        self.counts = manifest['counts']
+        self.dirty = set()
+        # shard -> names, filled through add_names as the library loads and kept current from
+        # store events, so a save never has to look at names outside the dirty shards. None when
+        # unknown (a new library, or after Remove All); the next save then sorts every name once.
+        self.members = [set() for _ in range(self.count)]
+
+    @classmethod
+    def create(cls, path, count):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, SHARD_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({'format': 'annotapp-shards', 'version': 1, 'shards': count, 'counts': [0] * count}, f)
+        library = cls(path)
+        library.dirty.update(range(count))
+        library.members = None
+        return library
+
+    def shard_of(self, name):
+        return zlib.crc32(str(name).encode('utf-8')) % self.count
+
+    def shard_path(self, index):
+        return os.path.join(self.path, f"shard-{index:04d}.jsonl")
+
+    def shard_paths(self):
+        return [self.shard_path(index) for index in range(self.count)]
+
+    def iter_rows(self):
+        for path in self.shard_paths():
+            yield from read_shard(path)
+
+    def add_names(self, names):
+        if self.members is not None:
+            for name in names:
+                self.members[self.shard_of(name)].add(name)
+
+    def on_change(self, changes):
+        if changes.reset:
+            self.dirty.update(range(self.count))
+            self.members = None
+            return
+        self.dirty.update(self.shard_of(name) for name in changes.names())
+        if self.members is not None:
+            for name in changes.removed:
+                self.members[self.shard_of(name)].discard(name)
+            for old_name in changes.renamed:
+                self.members[self.shard_of(old_name)].discard(old_name)
+            self.add_names(changes.added)
+            self.add_names(changes.renamed.values())
+
+    def mark_dirty(self, name):
+        self.dirty.add(self.shard_of(name))
+
+    def save(self, store, tags_of):
+        """ Rewrite the dirty shards from store; returns how many were written """
+        if not self.dirty:
+            return 0
+        if self.members is None:
+            self.members = [set() for _ in range(self.count)]
+            self.add_names(store.keys())
+        for index in self.dirty:
+            names = sorted(self.members[index])
+            write_file_atomic(self.shard_path(index),
+                              lambda tmp_path: write_annotations(tmp_path, "jsonl", annotation_rows(store, tags_of, names)))
+            self.counts[index] = len(names)
+
+        def write_manifest(tmp_path):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'format': 'annotapp-shards', 'version': 1, 'shards': self.count, 'counts': self.counts}, f)
+        write_file_atomic(os.path.join(self.path, SHARD_MANIFEST), write_manifest)
+        saved = len(self.dirty)
+        self.dirty.clear()
+        return saved
+
+def iter_library_rows(path):
+    """ Rows of a collection, whether it is a workbook or a sharded library """
+    if is_sharded_library(path):
+        return ShardedLibrary(path).iter_rows()
+    return iter_annotation_rows(path, "xlsx")
+
+CHANGESET_FILTER = "Changesets (*.changes.jsonl)"
+CHANGESET_SUFFIX = ".changes.jsonl"
+
+def content_hash(text):
+    return hashlib.blake2b(str(text).encode('utf-8'), digest_size=12).hexdigest()
+
+def diff_against_hashes(store, base_hashes, names=None):
+    """ Puts and deletes turning a library with base_hashes into store, checking only names if given """
+    puts = []
+    for name in store.keys() if names is None else names:
+        if name in store:
+            new_hash = store.hash_of(name)
+            if base_hashes.get(name) != new_hash:
+                puts.append((name, store[name], base_hashes.get(name), new_hash))
+    if names is None:
+        deletes = [(name, base_hashes[name]) for name in base_hashes.keys() - store.keys()]
+    else:
+        deletes = [(name, base_hashes[name]) for name in names if name not in store and name in base_hashes]
+    return puts, deletes
+
+def write_changeset(filepath, puts, deletes):
+    # JSON Lines: a header, then one put/delete per line carrying the content hash it expects to replace
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'changeset': 1, 'created': time.time(), 'puts': len(puts), 'deletes': len(deletes)}) + '\n')
+        for name, annotation, base, new_hash in puts:
+            f.write(json.dumps({'op': 'put', 'Name': name, 'Annotation': annotation, 'base': base, 'hash': new_hash},
+                               ensure_ascii=False) + '\n')
+        for name, base in deletes:
+            f.write(json.dumps({'op': 'delete', 'Name': name, 'base': base}, ensure_ascii=False) + '\n')
+
+def is_changeset(filepath):
+    if not filepath.lower().endswith(('.jsonl', '.ndjson')):
+        return False
+    with open(filepath, encoding='utf-8') as f:
+        try:
+            return 'changeset' in json.loads(f.readline() or '{}')
+        except ValueError:
+            return False
+
+def read_changeset(filepath):
+    with open(filepath, encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('changeset') != 1:
+            raise ValueError("Unsupported changeset version")
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['op'] == 'put' and content_hash(entry['Annotation']) != entry['hash']:
+                raise ValueError(f"Changeset entry '{entry['Name']}' does not match its content hash")
+            yield entry
+
+class ChangeTracker:
+    # Change stamps since the last export, plus the content hashes that export contained
+    def __init__(self, path):
+        self.path = path
+        self.clock = 0
+        self.stamps = {}
+        self.baseline = {}
+        self.rescan = True  # Set when per-name stamps cannot be trusted, e.g. after Remove All
+
+    def load(self, library_file):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.clock = state['clock']
+        self.stamps = state['stamps']
+        self.baseline = state['baseline']
+        self.rescan = state['rescan']
+        # The workbook was changed outside the app since the stamps were written
+        if os.path.exists(library_file) and os.path.getmtime(library_file) > os.path.getmtime(self.path) + 1:
+            self.rescan = True
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'clock': self.clock, 'stamps': self.stamps, 'baseline': self.baseline, 'rescan': self.rescan}, f)
+
+    def record(self, changes):
+        self.clock += 1
+        if changes.reset:
+            self.rescan = True
+        else:
+            for name in changes.names():
+                self.stamps[str(name)] = self.clock
+
+    def changes(self, store):
+        return diff_against_hashes(store, self.baseline, None if self.rescan else list(self.stamps))
+
+    def mark_exported(self, store, puts=None, deletes=None):
+        if puts is None:
+            self.baseline = {name: store.hash_of(name) for name in store.keys()}
+        else:
+            for name, annotation, base, new_hash in puts:
+                self.baseline[name] = new_hash
+            for name, base in deletes:
+                self.baseline.pop(name, None)
+        self.stamps.clear()
+        self.rescan = False
+
+class TagIndex:
+    # Tag -> bitset over annotation ids, held in Python ints, so AND/OR/NOT filters are a few
+    # big-integer operations however many annotations there are
+    def __init__(self, store):
+        self.store = store
+        self.ids = {}  # name -> id
+        self.names = []  # id -> name
+        self.tags = {}  # name -> tags; kept after removal so an undo brings the tags back
+        self.members = {}  # tag -> bitset
+        self.live = 0  # bitset of the names currently in the library
+        self.listeners = []  # Called with the name after set_tags
+
+    def _id(self, name):
+        index = self.ids.get(name)
+        if index is None:
+            index = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def add_names(self, names, tags_by_name):
+        # Bulk load, one batch at a time: the batch's ids are (nearly) consecutive, so its bits are
+        # set in bytearrays covering just that range and shifted into place once. Tags already in
+        # the index win over tags_by_name, so edits made while loading are kept.
+        if not names:
+            return
+        indexes = [self._id(name) for name in names]
+        start = min(indexes)
+        size = (max(indexes) - start) // 8 + 1
+        live = bytearray(size)
+        members = {}
+        for name, index in zip(names, indexes):
+            offset = index - start
+            live[offset >> 3] |= 1 << (offset & 7)
+            tags = tags_by_name.get(name, ())
+            if tags and name not in self.tags:
+                self.tags[name] = tags
+                for tag in tags:
+                    members.setdefault(tag, bytearray(size))[offset >> 3] |= 1 << (offset & 7)
+        self.live |= int.from_bytes(live, 'little') << start
+        for tag, bits in members.items():
+            self.members[tag] = self.members.get(tag, 0) | int.from_bytes(bits, 'little') << start
+
+    def set_tags(self, name, tags):
+        bit = 1 << self._id(name)
+        for tag in self.tags.get(name, ()):
+            self.members[tag] &= ~bit
+            if not self.members[tag]:
+                del self.members[tag]
+        tags = parse_tags(tags)
+        if tags:
+            self.tags[name] = tags
+        else:
+            self.tags.pop(name, None)
+        for tag in tags:
+            self.members[tag] = self.members.get(tag, 0) | bit
+        for listener in self.listeners:
+            listener(name)
+
+    def tags_of(self, name):
+        return self.tags.get(name, ())
+
+    def on_change(self, changes):
+        if changes.reset:
+            # The whole library was swapped; recompute which ids are live
+            indexes = [self._id(name) for name in self.store.keys()]
+            live = bytearray((len(self.names) + 7) // 8)
+            for index in indexes:
+                live[index >> 3] |= 1 << (index & 7)
+            self.live = int.from_bytes(live, 'little')
+            return
+        for name in changes.removed:
+            self.live &= ~(1 << self._id(name))
+        for name in changes.added:
+            self.live |= 1 << self._id(name)
+        for old_name, new_name in changes.renamed.items():
+            # Tags follow the entry; renaming it back moves them back
+            self.live = (self.live & ~(1 << self._id(old_name))) | 1 << self._id(new_name)
+            tags = self.tags_of(old_name)
+            self.set_tags(old_name, ())
+            self.set_tags(new_name, tags)
+
+    def all_tags(self):
+        return sorted(tag for tag, bits in self.members.items() if bits & self.live)
+
+    def query(self, expression, names=None):
+        """ Names matching a filter such as 'refund #billing #urgent|#vip -#old', from all names or the given ones """
+        bits = None
+        words = []
+        for term in expression.split():
+            negate = term.startswith('-#')
+            if negate or term.startswith('#'):
+                alternatives = term.lstrip('-#').split('|')
+                term_bits = 0
+                for tag in alternatives:
+                    term_bits |= self.members.get(tag.lstrip('#').lower(), 0)
+                if bits is None:
+                    bits = self.live
+                bits = bits & ~term_bits if negate else bits & term_bits
+            else:
+                words.append(term.lower())
+        if names is None:
+            names = self.store.keys() if bits is None else self._decode(bits)
+        elif bits is not None:
+            names = [name for name in names if bits >> self.ids[name] & 1]
+        if words:
+            names = [name for name in names if all(word in name.lower() for word in words)]
+        return names
+
+    def _decode(self, bits):
+        # Walk the bytes instead of peeling bits off a big int one at a time
+        data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+        return [self.names[(offset << 3) + bit]
+                for offset, byte in enumerate(data) if byte
+                for bit in range(8) if byte >> bit & 1]
+
+# A use counts half as much after this many seconds
+USAGE_HALF_LIFE = 7 * 24 * 3600
+
+class UsageTracker:
+    # Scores are kept as log2 of sum(2 ** (t_use / half_life)). Decay is then implicit: newer uses
+    # simply weigh more, scores never need rescaling, and every update is O(1).
+    def __init__(self, path, top_n=8):
+        self.path = path
+        self.top_n = top_n
+        self.stats = {}  # name -> [score, last used, use count]
+        self.top = []  # Best first, at most top_n names
+        self._top_stale = True
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.stats = {name: [score, last_used, count] for name, score, last_used, count in json.load(f)}
+        except (OSError, ValueError):
+            self.stats = {}
+        self._top_stale = True
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump([[name, round(score, 6), round(last_used), count]
+                       for name, (score, last_used, count) in self.stats.items()], f, separators=(',', ':'))
+
+    def score(self, name):
+        entry = self.stats.get(name)
+        return entry[0] if entry else -math.inf
+
+    def touch(self, name, now=None):
+        """ Record a use; returns True when the top list changed """
+        now = time.time() if now is None else now
+        weight = now / USAGE_HALF_LIFE
+        entry = self.stats.get(name)
+        if entry is None:
+            self.stats[name] = [weight, now, 1]
+        else:
+            high = max(entry[0], weight)
+            entry[0] = high + math.log2(2 ** (entry[0] - high) + 2 ** (weight - high))
+            entry[1] = now
+            entry[2] += 1
+        if self._top_stale:
+            return True
+        # Scores only grow, so the name can only move up the short top list
+        before = list(self.top)
+        if name in self.top:
+            self.top.remove(name)
+        position = len(self.top)
+        while position > 0 and self.score(self.top[position - 1]) < self.score(name):
+            position -= 1
+        if position < self.top_n:
+            self.top.insert(position, name)
+            del self.top[self.top_n:]
+        return self.top != before
+
+    def on_change(self, changes):
+        for old_name, new_name in changes.renamed.items():
+            if old_name in self.stats:
+                self.stats[new_name] = self.stats.pop(old_name)
+                self._top_stale = True
+        if (changes.reset or any(name in self.top for name in changes.removed)
+                or any(name in self.stats for name in changes.added)):
+            self._top_stale = True
+
+    def top_names(self, store):
+        if self._top_stale:
+            self.top = sorted((name for name in self.stats if name in store),
+                              key=lambda name: -self.score(name))[:self.top_n]
+            self._top_stale = False
+        return self.top
+
+    def ordered(self, names):
+        return sorted(names, key=lambda name: (-self.score(name), name))
+
+STATS_LARGEST = 10
+# Used annotations whose last use is older than this count as stale
+STATS_STALE_DAYS = 90
+
+class LibraryStats:
+    # Running totals kept up to date from store events, so the statistics panel never scans the library
+    def __init__(self, store, usage):
+        self.store = store
+        self.usage = usage
+        self.reset()
+
+    def reset(self):
+        self.total_chars = 0
+        self.lengths = {}  # name -> length as counted
+        self.hashes = {}  # name -> content hash as counted
+        self.by_hash = {}  # content hash -> number of names with that body
+        self.duplicate_groups = 0  # bodies held by more than one name
+        self.duplicate_entries = 0  # names beyond the first in each of those groups
+        self.histogram = {}  # bucket -> count; bucket b holds lengths with b binary digits
+        self.used = 0  # names in the library with any recorded use
+        self.largest = []  # heap of (-length, name); pairs that went stale are dropped when read
+
+    def rebuild(self):
+        self.reset()
+        self.add_names(list(self.store.keys()))
+
+    def add_names(self, names):
+        for name in names:
+            length = self.store.length(name)
+            digest = self.store.hash_of(name)
+            self.lengths[name] = length
+            self.hashes[name] = digest
+            self.total_chars += length
+            bucket = length.bit_length()
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+            same = self.by_hash.get(digest, 0) + 1
+            self.by_hash[digest] = same
+            if same == 2:
+                self.duplicate_groups += 1
+            if same >= 2:
+                self.duplicate_entries += 1
+            if name in self.usage.stats:
+                self.used += 1
+            heapq.heappush(self.largest, (-length, name))
+        if len(self.largest) > 2 * len(self.lengths) + 64:
+            # Edits leave stale pairs behind; start over from the current lengths
+            self.largest = [(-length, name) for name, length in self.lengths.items()]
+            heapq.heapify(self.largest)
+
+    def remove_name(self, name):
+        length = self.lengths.pop(name)
+        digest = self.hashes.pop(name)
+        self.total_chars -= length
+        bucket = length.bit_length()
+        self.histogram[bucket] -= 1
+        if not self.histogram[bucket]:
+            del self.histogram[bucket]
+        same = self.by_hash.pop(digest) - 1
+        if same:
+            self.by_hash[digest] = same
+            self.duplicate_entries -= 1
+            if same == 1:
+                self.duplicate_groups -= 1
+        if name in self.usage.stats:
+            self.used -= 1
+
+    def on_change(self, changes):
+        if changes.reset:
+            self.rebuild()
+            return
+        for name in changes.removed + changes.changed:
+            if name in self.lengths:
+                self.remove_name(name)
+        for old_name, new_name in changes.renamed.items():
+            # Same body under a new name; UsageTracker has already moved the uses along
+            self.lengths[new_name] = self.lengths.pop(old_name)
+            self.hashes[new_name] = self.hashes.pop(old_name)
+            heapq.heappush(self.largest, (-self.lengths[new_name], new_name))
+        self.add_names(changes.added + changes.changed)
+
+    def on_use(self, name):
+        # Call before UsageTracker.touch, which is what makes the name count as used
+        if name in self.lengths and name not in self.usage.stats:
+            self.used += 1
+
+    def largest_entries(self, limit=STATS_LARGEST):
+        found = []
+        while self.largest and len(found) < limit:
+            length, name = heapq.heappop(self.largest)
+            if self.lengths.get(name) == -length and (length, name) not in found:
+                found.append((length, name))
+        for entry in found:
+            heapq.heappush(self.largest, entry)
+        return [(name, -length) for length, name in found]
+
+    def snapshot(self):
+        count = len(self.lengths)
+        cutoff = time.time() - STATS_STALE_DAYS * 86400
+        # Only names that were ever used are looked at here, not the whole library
+        stale = sum(1 for name, (score, last_used, uses) in self.usage.stats.items()
+                    if last_used < cutoff and name in self.lengths)
+        return {
+            'generated': datetime.now().isoformat(' ', 'seconds'),
+            'count': count,
+            'total_chars': self.total_chars,
+            'average_chars': round(self.total_chars / count, 1) if count else 0,
+            'largest': [{'name': name, 'chars': length} for name, length in self.largest_entries()],
+            'duplicate_groups': self.duplicate_groups,
+            'duplicate_entries': self.duplicate_entries,
+            'never_used': count - self.used,
+            'stale': stale,
+            'stale_days': STATS_STALE_DAYS,
+            'size_distribution': [{'min': 0 if bucket == 0 else 1 << (bucket - 1), 'max': (1 << bucket) - 1,
+                                   'count': self.histogram[bucket]} for bucket in sorted(self.histogram)],
+        }
+
+# MinHash works modulo a Mersenne prime small enough that a * x + b never overflows uint64
+MINHASH_PRIME = (1 << 31) - 1
+
+class NearDuplicateFinder:
+    # MinHash signatures over word 3-grams, bucketed with LSH bands so only likely pairs are compared
+    def __init__(self, num_perm=64, seed=1):
+        self.num_perm = num_perm
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MINHASH_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MINHASH_PRIME, size=num_perm).astype(np.uint64)
+        self.cache = {}  # content hash -> signature; unchanged annotations are never re-hashed
+
+    def signature(self, text):
+        words = re.findall(r"\w+", text.lower())
+        shingles = {' '.join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))} if words else {text}
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) % MINHASH_PRIME for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % MINHASH_PRIME).min(axis=1)
+
+    def band_rows(self, threshold):
+        # Rows per band whose LSH threshold (1/bands) ** (1/rows) sits just below the requested one
+        rows = 1
+        for candidate in (2, 4, 8, 16, 32):
+            if self.num_perm % candidate == 0 and (candidate / self.num_perm) ** (1 / candidate) <= threshold - 0.05:
+                rows = candidate
+        return rows
+
+    def clusters(self, store, threshold=0.8):
+        """ Groups of names whose estimated similarity is at least threshold, largest group first """
+        cache = {}
+        names = []
+        signatures = []
+        for name, text in store.items():
+            if not isinstance(text, str) or not text.strip():
+                continue
+            key = store.hash_of(name)
+            signature = self.cache.get(key)
+            if signature is None:
+                signature = self.signature(text)
+            cache[key] = signature
+            names.append(name)
+            signatures.append(signature)
+        self.cache = cache  # Drop signatures of bodies that no longer exist
+
+        parent = list(range(len(names)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def similarity(i, j):
+            return float(np.mean(signatures[i] == signatures[j]))
+
+        rows = self.band_rows(threshold)
+        for start in range(0, self.num_perm, rows):
+            buckets = {}
+            for i, signature in enumerate(signatures):
+                buckets.setdefault(signature[start:start + rows].tobytes(), []).append(i)
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                # Small buckets are checked pairwise; big ones (mass boilerplate) against their first member
+                pairs = ((members[x], members[y]) for x in range(len(members)) for y in range(x + 1, len(members))) \
+                    if len(members) <= 50 else ((members[0], other) for other in members[1:])
+                for i, j in pairs:
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j and similarity(i, j) >= threshold:
+                        parent[root_j] = root_i
+
+        groups = {}
+        for i in range(len(names)):
+            groups.setdefault(find(i), []).append(i)
+        result = []
+        for members in groups.values():
+            if len(members) > 1:
+                score = min(similarity(members[0], other) for other in members[1:])
+                result.append((score, sorted(names[i] for i in members)))
+        result.sort(key=lambda item: (-len(item[1]), -item[0]))
+        return result
+
+class DuplicateReportDialog(QDialog):
+    def __init__(self, app, clusters, threshold):
+        super().__init__(app)
+        self.setWindowTitle("Near Duplicates")
+        self.setMinimumSize(500, 400)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"{len(clusters)} group(s) at least {threshold:.0%} similar. Double-click a name to show it."))
+
+        tree = QTreeWidget()
+        tree.setHeaderHidden(True)
+        for number, (score, names) in enumerate(clusters, 1):
+            group = QTreeWidgetItem([f"Group {number}: {len(names)} annotations, ~{score:.0%} similar"])
+            for name in names:
+                group.addChild(QTreeWidgetItem([name]))
+            tree.addTopLevelItem(group)
+        tree.itemDoubleClicked.connect(lambda item, column: item.parent() and app.show_annotation(item.text(0)))
+        layout.addWidget(tree)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+class LibraryStatsDialog(QDialog):
+    def __init__(self, app, snapshot):
+        super().__init__(app)
+        self.snapshot = snapshot
+        self.setWindowTitle("Statistics")
+        self.setMinimumSize(420, 420)
+        layout = QVBoxLayout(self)
+
+        tree = QTreeWidget()
+        tree.setHeaderLabels(["Statistic", "Value"])
+        for label, value in (("Annotations", f"{snapshot['count']:,}"),
+                             ("Total size", f"{snapshot['total_chars']:,} characters"),
+                             ("Average size", f"{snapshot['average_chars']:,} characters"),
+                             ("Duplicate bodies", f"{snapshot['duplicate_groups']:,} bodies shared by "
+                                                  f"{snapshot['duplicate_groups'] + snapshot['duplicate_entries']:,} annotations"),
+                             ("Never used", f"{snapshot['never_used']:,}"),
+                             (f"Not used in {snapshot['stale_days']} days", f"{snapshot['stale']:,}")):
+            tree.addTopLevelItem(QTreeWidgetItem([label, value]))
+        largest = QTreeWidgetItem(["Largest", ""])
+        for entry in snapshot['largest']:
+            largest.addChild(QTreeWidgetItem([entry['name'], f"{entry['chars']:,}"]))
+        distribution = QTreeWidgetItem(["Size distribution", "annotations"])
+        for bucket in snapshot['size_distribution']:
+            distribution.addChild(QTreeWidgetItem([f"{bucket['min']:,} - {bucket['max']:,} characters", f"{bucket['count']:,}"]))
+        tree.addTopLevelItem(largest)
+        tree.addTopLevelItem(distribution)
+        largest.setExpanded(True)
+        distribution.setExpanded(True)
+        tree.resizeColumnToContents(0)
+        tree.itemDoubleClicked.connect(lambda item, column: item.parent() is largest and app.show_annotation(item.text(0)))
+        layout.addWidget(tree)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        export_button = button_box.addButton("Export JSON...", QDialogButtonBox.ActionRole)
+        export_button.clicked.connect(self.export_json)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+    def export_json(self):
+        filepath, _ = QFileDialog.getSaveFileName(self, "Export Statistics", "", "JSON (*.json)")
+        if filepath:
+            try:
+                with open(filepath, 'w', encoding='utf-8') as f:
+                    json.dump(self.snapshot, f, ensure_ascii=False, indent=2)
+            except OSError as e:
+                QMessageBox.critical(self, "Error", f"Failed to export statistics: {e}")
+
+def required_literal(pattern):
+    """ Longest literal that every match of the regex must contain, or '' if none can be derived safely """
+    if '|' in pattern or '(?' in pattern:
+        return ''
+    best = run = ''
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped and not escaped.isalnum() and depth == 0:
+                run += escaped
+            elif escaped and escaped in 'dDwWsSbBAZ':
+                best, run = max(best, run, key=len), ''
+            elif escaped:
+                # \x41, \101, \1, \N{...}: the characters after the letter are not literal text
+                return ''
+            i += 2
+            continue
+        if char in '*?{':
+            # The previous atom may be absent, so it cannot be part of the literal
+            best, run = max(best, run[:-1], key=len), ''
+            if char == '{':
+                i = pattern.find('}', i) if '}' in pattern[i:] else len(pattern)
+        elif char == '[':
+            best, run = max(best, run, key=len), ''
+            # Skip the character class, honouring escapes and a leading ']'
+            i += 2 if pattern[i + 1:i + 2] == '^' else 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif char in '()':
+            best, run = max(best, run, key=len), ''
+            depth += 1 if char == '(' else -1
+        elif char in '+.^$':
+            best, run = max(best, run, key=len), ''
+        elif depth == 0:
+            run += char
+        i += 1
+    return max(best, run, key=len)
+
+class FindReplaceWorker(QThread):
+    # Runs the regex over a snapshot of the library so the UI stays responsive
+    results_ready = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, items, pattern, replacement, parent=None):
+        super().__init__(parent)
+        self.items = items
+        self.pattern = pattern
+        self.replacement = replacement
+        self.ignore_case = bool(pattern.flags & re.IGNORECASE)
+        literal = required_literal(pattern.pattern)
+        self.literal = literal.lower() if self.ignore_case else literal
+
+    def run(self):
+        # An exception escaping run() aborts the whole application
+        try:
+            self.results_ready.emit(self.find())
+        except re.error as e:
+            self.failed.emit(str(e))
+
+    def find(self):
+        results = []
+        for name, text in self.items:
+            if not isinstance(text, str):
+                continue
+            # Cheap substring test first: bodies without the literal cannot match
+            if self.literal and self.literal not in (text.lower() if self.ignore_case else text):
+                continue
+            new_text, count = self.pattern.subn(self.replacement, text)
+            if count:
+                match = self.pattern.search(text)
+                before = text[max(0, match.start() - 30):match.start()].replace('\n', ' ')
+                after = text[match.end():match.end() + 30].replace('\n', ' ')
+                preview = f"...{before}[{match.group()} -> {match.expand(self.replacement) if isinstance(self.replacement, str) else self.replacement(match)}]{after}..."
+                results.append((name, text, new_text, count, preview))
+        return results
+
+FIND_PAGE_SIZE = 100
+
+class FindReplaceDialog(QDialog):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.setWindowTitle("Find and Replace")
+        self.setMinimumSize(600, 450)
+        self.results = []
+        self.previewed = None  # (pattern, replacement) the results were computed with
+        self.page = 0
+        self.worker = None
+
+        layout = QVBoxLayout(self)
+        form_layout = QFormLayout()
+        self.find_edit = QLineEdit()
+        self.replace_edit = QLineEdit()
+        form_layout.addRow("Find:", self.find_edit)
+        form_layout.addRow("Replace with:", self.replace_edit)
+        layout.addLayout(form_layout)
+
+        options_layout = QHBoxLayout()
+        self.regex_check = QCheckBox("Regular expression")
+        self.case_check = QCheckBox("Match case")
+        options_layout.addWidget(self.regex_check)
+        options_layout.addWidget(self.case_check)
+        options_layout.addStretch()
+        self.preview_button = QPushButton("Preview")
+        self.preview_button.clicked.connect(self.run_preview)
+        options_layout.addWidget(self.preview_button)
+        layout.addLayout(options_layout)
+
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+        self.result_list = QListWidget()
+        layout.addWidget(self.result_list)
+
+        page_layout = QHBoxLayout()
+        self.prev_button = QPushButton("< Prev")
+        self.prev_button.clicked.connect(lambda: self.show_page(self.page - 1))
+        self.next_button = QPushButton("Next >")
+        self.next_button.clicked.connect(lambda: self.show_page(self.page + 1))
+        self.page_label = QLabel("")
+        page_layout.addWidget(self.prev_button)
+        page_layout.addWidget(self.page_label)
+        page_layout.addWidget(self.next_button)
+        page_layout.addStretch()
+        layout.addLayout(page_layout)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        self.replace_button = button_box.addButton("Replace All", QDialogButtonBox.ApplyRole)
+        self.replace_button.clicked.connect(self.replace_all)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+        self.show_page(0)
+
+        # Results only hold for the fields they were previewed with
+        self.find_edit.textChanged.connect(self.discard_preview)
+        self.replace_edit.textChanged.connect(self.discard_preview)
+        self.regex_check.stateChanged.connect(self.discard_preview)
+        self.case_check.stateChanged.connect(self.discard_preview)
+
+    def discard_preview(self):
+        if self.previewed is None:
+            return
+        self.previewed = None
+        self.results = []
+        self.status_label.setText("Search changed; run Preview again.")
+        self.show_page(0)
+
+    def compiled(self):
+        """ (pattern, replacement); raises re.error for an invalid expression or replacement template """
+        flags = 0 if self.case_check.isChecked() else re.IGNORECASE
+        if self.regex_check.isChecked():
+            pattern = re.compile(self.find_edit.text(), flags)
+            replacement = self.replace_edit.text()
+            # Templates are only checked when expanded, so expand this one against a pattern with
+            # the same groups that always matches; bad escapes and group references fail here
+            try:
+                always = re.compile(f"(?:{pattern.pattern})|", pattern.flags)
+            except re.error:
+                always = None  # e.g. inline global flags; the worker still reports the error
+            if always is not None:
+                always.match('').expand(replacement)
+            return pattern, replacement
+        replacement = self.replace_edit.text()
+        # Literal mode: no backslash processing in the replacement either
+        return re.compile(re.escape(self.find_edit.text()), flags), lambda match: replacement
+
+    def run_preview(self):
+        if not self.find_edit.text() or (self.worker and self.worker.isRunning()):
+            return
+        try:
+            pattern, replacement = self.compiled()
+        except re.error as e:
+            self.status_label.setText(f"Invalid expression: {e}")
+            return
+        self.results = []
+        self.previewed = (pattern, replacement)
+        self.preview_button.setEnabled(False)
+        self.replace_button.setEnabled(False)
+        self.status_label.setText("Searching...")
+        self.worker = FindReplaceWorker(list(self.app.annotations.items()), pattern, replacement, self)
+        self.worker.results_ready.connect(self.on_results)
+        self.worker.failed.connect(self.on_failed)
+        self.worker.start()
+
+    def on_results(self, results):
+        self.preview_button.setEnabled(True)
+        if self.previewed is None:
+            return  # The fields changed while searching
+        self.results = results
+        total = sum(result[3] for result in results)
+        self.status_label.setText(f"{total} match(es) in {len(results)} annotation(s)")
+        self.show_page(0)
+
+    def on_failed(self, message):
+        self.preview_button.setEnabled(True)
+        self.previewed = None
+        self.status_label.setText(f"Invalid expression: {message}")
+
+    def show_page(self, page):
+        pages = max(1, (len(self.results) + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE)
+        self.page = max(0, min(page, pages - 1))
+        self.result_list.clear()
+        start = self.page * FIND_PAGE_SIZE
+        self.result_list.addItems([f"{name} ({count}): {preview}"
+                                   for name, _, _, count, preview in self.results[start:start + FIND_PAGE_SIZE]])
+        self.page_label.setText(f"Page {self.page + 1} of {pages}")
+        self.prev_button.setEnabled(self.page > 0)
+        self.next_button.setEnabled(self.page < pages - 1)
+        self.replace_button.setEnabled(bool(self.results))
+
+    def replace_all(self):
+        # Bodies edited since the preview are redone with the same pattern and replacement
+        if self.previewed is None:
+            return
+        self.app.apply_replacements(self.results, *self.previewed)
+        self.previewed = None
+        self.results = []
+        self.status_label.setText("Replaced.")
+        self.show_page(0)
+
+    def reject(self):
+        if self.worker and self.worker.isRunning():
+            self.worker.wait()
+        super().reject()
+
+DEFAULT_COLLECTIONS = {"Default": "annotations.xlsx"}
+
+API_DEFAULT_PORT = 8765
+# The headless server writes changes back once none have arrived for this many seconds
+HEADLESS_SAVE_DELAY = 2.0
+
+class AnnotationApiHandler(BaseHTTPRequestHandler):
+    server_version = f"AnnotAPP/{VERSION}"
+
+    def do_GET(self):
+        self.server.api.handle(self, "GET")
+
+    def do_PUT(self):
+        self.server.api.handle(self, "PUT")
+
+    def do_POST(self):
+        self.server.api.handle(self, "POST")
+
+    def log_message(self, format, *args):
+        pass  # No console in the packaged app
+
+class AnnotationApi:
+    """
+    Localhost-only JSON API over the active store:
+      GET  /annotations                 names (ETag for the whole collection)
+      GET  /annotations/<name>          one annotation (ETag is its content hash)
+      GET  /search?q=words              names whose name or text contains every word
+      POST /batch {"names": {...}}      many annotations at once; pass name -> ETag to skip unchanged ones
+      PUT  /annotations/<name>          create or replace, honouring If-Match
+    """
+    def __init__(self, get_store, dispatch, put=None, port=API_DEFAULT_PORT):
+        self.get_store = get_store
+        self.dispatch = dispatch  # Runs a callable on the thread that owns the store
+        self.put = put
+        self.port = port
+        self.httpd = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', self.port), AnnotationApiHandler)
+        self.httpd.api = self
+        self.port = self.httpd.server_address[1]  # The one picked by the OS when port is 0
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def collection_etag(self, store):
+        return f'"{id(store):x}-{store.version}"'
+
+    def handle(self, request, method):
+        # Only answer requests addressed to localhost, which shuts out DNS-rebinding pages
+        host = request.headers.get('Host', '').rsplit(':', 1)[0]
+        if host not in ('127.0.0.1', 'localhost'):
+            return self.send(request, 403, {'error': 'forbidden host'})
+        body = None
+        if method in ('PUT', 'POST'):
+            if request.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+                return self.send(request, 415, {'error': 'expected application/json'})
+            try:
+                body = json.loads(request.rfile.read(int(request.headers.get('Content-Length', 0))) or b'{}')
+            except ValueError:
+                return self.send(request, 400, {'error': 'invalid JSON'})
+        url = urlsplit(request.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/', 1)]
+        try:
+            status, etag, payload = self.dispatch(lambda: self.route(method, parts, parse_qs(url.query), request.headers, body))
+        except Exception as e:
+            return self.send(request, 500, {'error': str(e)})
+        if etag is not None and status == 200 and method == "GET" and request.headers.get('If-None-Match') == etag:
+            return self.send(request, 304, None, etag)
+        self.send(request, status, payload, etag)
+
+    def route(self, method, parts, query, headers, body):
+        store = self.get_store()
+        if parts[0] == 'annotations' and len(parts) == 1 and method == "GET":
+            return 200, self.collection_etag(store), {'names': list(store.keys())}
+        if parts[0] == 'annotations' and len(parts) == 2:
+            name = parts[1]
+            if method == "GET":
+                if name not in store:
+                    return 404, None, {'error': 'not found'}
+                etag = f'"{store.hash_of(name)}"'
+                return 200, etag, {'name': name, 'annotation': store[name]}
+            if method == "PUT":
+                if not isinstance(body, dict) or not isinstance(body.get('annotation'), str):
+                    return 400, None, {'error': "body must be {\"annotation\": \"...\"}"}
+                expected = headers.get('If-Match')
+                current = f'"{store.hash_of(name)}"' if name in store else None
+                if expected is not None and expected != '*' and expected != current:
+                    return 412, current, {'error': 'annotation changed'}
+                created = name not in store
+                (self.put or store.set)(name, body['annotation'])
+                return (201 if created else 200), f'"{content_hash(body["annotation"])}"', {'name': name}
+        if parts[0] == 'search' and method == "GET":
+            words = ' '.join(query.get('q', [])).lower().split()
+            return 200, None, {'names': [name for name, text in store.items()
+                                         if all(word in f"{name}\n{text}".lower() for word in words)]}
+        if parts[0] == 'batch' and method == "POST":
+            names = body.get('names', []) if isinstance(body, dict) else []
+            known = names if isinstance(names, dict) else dict.fromkeys(names)
+            found, unchanged, missing = {}, [], []
+            for name, etag in known.items():
+                if name not in store:
+                    missing.append(name)
+                    continue
+                current = f'"{store.hash_of(name)}"'
+                if etag == current:
+                    unchanged.append(name)
+                else:
+                    found[name] = {'annotation': store[name], 'etag': current}
+            return 200, None, {'annotations': found, 'unchanged': unchanged, 'missing': missing}
+        return 404, None, {'error': 'unknown endpoint'}
+
+    def send(self, request, status, payload, etag=None):
+        data = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        request.send_response(status)
+        if etag is not None:
+            request.send_header('ETag', etag)
+        if payload is not None:
+            request.send_header('Content-Type', 'application/json; charset=utf-8')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+class MainThreadDispatcher(QObject):
+    # Hands callables from API threads to the GUI thread and waits for their result
+    call = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.call.connect(self._run, Qt.QueuedConnection)
+
+    def _run(self, job):
+        job()
+
+    def __call__(self, fn):
+        done = threading.Event()
+        result = []
+
+        def job():
+            try:
+                result.append((True, fn()))
+            except Exception as e:
+                result.append((False, e))
+            finally:
+                done.set()
+
+        self.call.emit(job)
+        if not done.wait(30):
+            raise TimeoutError("the application is busy")
+        ok, value = result[0]
+        if not ok:
+            raise value
+        return value
+
+def serve_headless(annotation_file, port):
+    """ Serve a workbook or sharded library through the local API without the GUI; changes are written
+    back shortly after they stop arriving, and on Ctrl+C """
+    store = AnnotationStore()
+    tags_by_name = {}
+    if os.path.exists(annotation_file):
+        with store.recording_suspended():
+            for name, annotation, tags, created, modified in iter_library_rows(annotation_file):
+                store.set(name, annotation, created, modified)
+                tags_by_name[name] = tags or ()
+    library = ShardedLibrary(annotation_file) if is_sharded_library(annotation_file) else None
+    if library is not None:
+        library.add_names(store.keys())
+        store.listeners.append(library.on_change)
+    lock = threading.Lock()
+
+    def dispatch(fn):
+        with lock:
+            return fn()
+
+    def save():
+        # Under the lock, so the file is a consistent snapshot; replaced atomically in case the
+        # process is killed halfway, since a windowed build has no console to stop it from
+        if library is not None:
+            library.save(store, lambda name: tags_by_name.get(name, ()))
+        else:
+            write_file_atomic(annotation_file, lambda tmp_path: write_xlsx(
+                tmp_path, annotation_rows(store, lambda name: tags_by_name.get(name, ()))))
+
+    api = AnnotationApi(lambda: store, dispatch, port=port)
+    api.start()
+    saved = seen = store.version
+    print(f"Serving {len(store)} annotations from {annotation_file} on http://127.0.0.1:{api.port}")
+    stop = threading.Event()
+    try:
+        # A timed wait, so Ctrl+C is noticed on Windows too
+        while not stop.wait(HEADLESS_SAVE_DELAY):
+            with lock:
+                # Saved once a full interval passed without changes
+                if store.version != saved and store.version == seen:
+                    try:
+                        save()
+                        saved = store.version
+                    except Exception as e:
+                        print(f"Failed to save {annotation_file}: {e}")
+                seen = store.version
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+        if store.version != saved:
+            save()
+
+class CollectionIndex:
+    # One word index shared by all collections. A collection is (re)indexed when it is searched
+    # and its stamp changed, so inactive workbooks are only parsed when a search needs them.
+    def __init__(self):
+        self.stamps = {}  # collection -> stamp the postings were built from
+        self.postings = {}  # collection -> {word: set of names}
+
+    def invalidate(self, collection):
+        self.stamps.pop(collection, None)
+        self.postings.pop(collection, None)
+
+    def refresh(self, collection, stamp, rows):
+        if collection in self.stamps and self.stamps[collection] == stamp:
+            return
+        postings = {}
+        for name, annotation in rows:
+            for word in set(re.findall(r"\w+", f"{name} {annotation}".lower())):
+                postings.setdefault(word, set()).add(name)
+        self.postings[collection] = postings
+        self.stamps[collection] = stamp
+
+    def search(self, query):
+        """ (collection, name) pairs containing every word of the query """
+        words = set(re.findall(r"\w+", query.lower()))
+        if not words:
+            return []
+        results = []
+        for collection, postings in self.postings.items():
+            matches = None
+            for word in sorted(words, key=lambda word: len(postings.get(word, ()))):
+                matches = postings.get(word, set()) if matches is None else matches & postings.get(word, set())
+                if not matches:
+                    break
+            results.extend((collection, name) for name in sorted(matches or ()))
+        return results
+
+class CollectionSearchDialog(QDialog):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.setWindowTitle("Search All Collections")
+        self.setMinimumSize(450, 350)
+        layout = QVBoxLayout(self)
+
+        self.query_edit = QLineEdit()
+        self.query_edit.setPlaceholderText("Words to find in names and annotations")
+        self.query_edit.returnPressed.connect(self.run_search)
+        layout.addWidget(self.query_edit)
+
+        self.result_list = QListWidget()
+        self.result_list.itemDoubleClicked.connect(self.open_result)
+        layout.addWidget(self.result_list)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+        self.results = []
+
+    def run_search(self):
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        failed = []
+        try:
+            for collection in self.app.collections:
+                # An unreadable workbook is left out of the results rather than ending the search
+                try:
+                    self.app.collection_index.refresh(collection, self.app.collection_stamp(collection),
+                                                      self.app.collection_rows(collection))
+                except Exception as e:
+                    self.app.collection_index.invalidate(collection)
+                    failed.append(f"{collection}: {e}")
+            self.results = self.app.collection_index.search(self.query_edit.text())
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.result_list.clear()
+        self.result_list.addItems([f"{collection} \u203a {name}" for collection, name in self.results])
+        if failed:
+            QMessageBox.warning(self, "Search All Collections", "Some collections could not be read:\n" + "\n".join(failed))
+
+    def open_result(self, item):
+        collection, name = self.results[self.result_list.row(item)]
+        self.app.show_search_result(collection, name)
+        self.accept()
+
+# Every KEYFRAME_INTERVAL-th revision also stores the full text, so reading any revision
+# replays at most KEYFRAME_INTERVAL // 2 deltas
+KEYFRAME_INTERVAL = 16
+
+class RevisionHistory:
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pending = 0
+
+    @property
+    def conn(self):
+        # Opened on first use so startup never touches the history file
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS revisions (
+                                    name TEXT NOT NULL,
+                                    rev INTEGER NOT NULL,
+                                    saved_at REAL NOT NULL,
+                                    length INTEGER NOT NULL,
+                                    checksum INTEGER NOT NULL,
+                                    text BLOB,
+                                    delta BLOB,
+                                    PRIMARY KEY (name, rev))""")
+        return self._conn
+
+    def record(self, name, old, new):
+        if name is None or not isinstance(new, str):
+            return
+        name = str(name)
+        last = self.conn.execute("SELECT rev, checksum FROM revisions WHERE name = ? ORDER BY rev DESC LIMIT 1",
+                                 (name,)).fetchone()
+        if last is None:
+            rev = 0
+            if isinstance(old, str):
+                # First change of an annotation that predates the history: keep its old text as revision 0
+                self._insert(name, 0, old, None)
+                rev = 1
+            delta = None
+        else:
+            rev = last[0] + 1
+            # Only chain a delta if the previous revision really is the text being replaced
+            if isinstance(old, str) and zlib.crc32(old.encode('utf-8')) == last[1]:
+                delta = make_text_delta(old, new)
+            else:
+                delta = None
+        self._insert(name, rev, new, delta)
+
+    def _insert(self, name, rev, text, delta):
+        data = text.encode('utf-8')
+        keyframe = delta is None or rev % KEYFRAME_INTERVAL == 0
+        self.conn.execute("INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (name, rev, time.time(), len(text), zlib.crc32(data),
+                           zlib.compress(data) if keyframe else None,
+                           zlib.compress(json.dumps(delta).encode('utf-8')) if delta is not None else None))
+        self._pending += 1
+
+    def commit(self):
+        if self._pending:
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self):
+        if self._conn is not None:
+            self.commit()
+            self._conn.close()
+            self._conn = None
+
+    def revisions(self, name):
+        # (rev, saved_at, length) for every stored revision, oldest first
+        return self.conn.execute("SELECT rev, saved_at, length FROM revisions WHERE name = ? ORDER BY rev",
+                                 (str(name),)).fetchall()
+
+    def text_at(self, name, rev):
+        name = str(name)
+        before = self.conn.execute("""SELECT rev FROM revisions WHERE name = ? AND rev <= ? AND text IS NOT NULL
+                                     ORDER BY rev DESC LIMIT 1""", (name, rev)).fetchone()
+        after = self.conn.execute("""SELECT rev FROM revisions WHERE name = ? AND rev >= ? AND text IS NOT NULL
+                                    ORDER BY rev LIMIT 1""", (name, rev)).fetchone()
+        if after is not None and (before is None or after[0] - rev < rev - before[0]):
+            # Walk backwards from the following keyframe
+            rows = self.conn.execute("""SELECT rev, text, delta FROM revisions WHERE name = ? AND rev > ? AND rev <= ?
+                                       ORDER BY rev DESC""", (name, rev, after[0])).fetchall()
+            if all(delta is not None for _, _, delta in rows):
+                text = zlib.decompress(rows[0][1]).decode('utf-8') if rows else self._keyframe(name, rev)
+                for _, _, delta in rows:
+                    text = apply_text_delta(text, self._delta(delta), reverse=True)
+                return text
+        if before is None:
+            raise KeyError(f"No revision {rev} stored for '{name}'")
+        rows = self.conn.execute("""SELECT delta FROM revisions WHERE name = ? AND rev > ? AND rev <= ?
+                                   ORDER BY rev""", (name, before[0], rev)).fetchall()
+        text = self._keyframe(name, before[0])
+        for (delta,) in rows:
+            text = apply_text_delta(text, self._delta(delta))
+        return text
+
+    def _keyframe(self, name, rev):
+        (data,) = self.conn.execute("SELECT text FROM revisions WHERE name = ? AND rev = ?", (name, rev)).fetchone()
+        return zlib.decompress(data).decode('utf-8')
+
+    @staticmethod
+    def _delta(blob):
+        return [tuple(op) for op in json.loads(zlib.decompress(blob))]
+
+class RevisionHistoryDialog(QDialog):
+    def __init__(self, app, name):
+        super().__init__(app)
+        self.app = app
+        self.name = name
+        self.setWindowTitle(f"History - {name}")
+        self.setMinimumSize(600, 400)
+
+        layout = QVBoxLayout(self)
+        splitter = QSplitter(Qt.Horizontal)
+        self.revision_list = QListWidget()
+        self.revision_list.currentRowChanged.connect(self.show_revision)
+        splitter.addWidget(self.revision_list)
+
+        self.text_view = QTextEdit()
+        self.text_view.setReadOnly(True)
+        self.text_view.setFont(QFont("Consolas, Monaco, Monospace", 10))
+        splitter.addWidget(self.text_view)
+        splitter.setStretchFactor(1, 1)
+        layout.addWidget(splitter)
+
+        self.diff_check = QCheckBox("Show diff against current")
+        self.diff_check.stateChanged.connect(lambda state: self.show_revision(self.revision_list.currentRow()))
+        layout.addWidget(self.diff_check)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        restore_button = button_box.addButton("Restore", QDialogButtonBox.ActionRole)
+        restore_button.clicked.connect(self.restore_revision)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+        self.revisions = app.revision_history.revisions(name)
+        for rev, saved_at, length in reversed(self.revisions):
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(saved_at))
+            self.revision_list.addItem(f"#{rev}  {stamp}  ({length} chars)")
+        if self.revisions:
+            self.revision_list.setCurrentRow(0)
+        else:
+            self.text_view.setPlainText("No revisions recorded yet.")
+            restore_button.setEnabled(False)
+
+    def selected_rev(self, row):
+        return self.revisions[len(self.revisions) - 1 - row][0]
+
+    def show_revision(self, row):
+        if row < 0:
+            return
+        text = self.app.revision_history.text_at(self.name, self.selected_rev(row))
+        if self.diff_check.isChecked():
+            current = self.app.annotations.get(self.name)
+            current = current if isinstance(current, str) else ""
+            text = ''.join(unified_diff(text.splitlines(keepends=True), current.splitlines(keepends=True),
+                                        fromfile=f"#{self.selected_rev(row)}", tofile="current")) or "No differences."
+        self.text_view.setPlainText(text)
+
+    def restore_revision(self):
+        row = self.revision_list.currentRow()
+        if row < 0:
+            return
+        self.app.restore_revision(self.name, self.app.revision_history.text_at(self.name, self.selected_rev(row)))
+        self.accept()
+
 class ToggleSwitch(QWidget):
     stateChanged = pyqtSignal(bool)
 
@@ -85,36 +2242,195 @@ class ToggleSwitch(QWidget):
             self.update()
             self.stateChanged.emit(self._enabled)
 
-class SmartSelectTextEdit(QTextEdit):
+# Placeholders such as {{date}}, {{date:%d/%m/%Y}}, {{time}}, {{datetime}}, {{user}} and {{clipboard}}
+# are filled in when an annotation is shown; unknown names are left as written
+TEMPLATE_FIELD = re.compile(r"\{\{\s*(\w+)(?::([^{}]*))?\s*\}\}")
+TEMPLATE_FORMATS = {'date': "%Y-%m-%d", 'time': "%H:%M", 'datetime': "%Y-%m-%d %H:%M"}
+TEMPLATE_FIELDS = set(TEMPLATE_FORMATS) | {'user', 'clipboard'}
+TEMPLATE_CACHE_SIZE = 256
+
+def compile_template(text):
+    """ Literal text and (field, argument, placeholder) parts, or None when the text has no usable placeholders """
+    parts = []
+    fields = set()
+    position = 0
+    for match in TEMPLATE_FIELD.finditer(text):
+        field = match.group(1).lower()
+        if field not in TEMPLATE_FIELDS:
+            continue
+        argument = match.group(2) if field in TEMPLATE_FORMATS else None
+        if argument:
+            try:
+                datetime.now().strftime(argument)
+            except ValueError:
+                continue  # Windows rejects directives such as %-d; the placeholder stays as written
+        if match.start() > position:
+            parts.append(text[position:match.start()])
+        parts.append((field, argument, match.group()))
+        fields.add(field)
+        position = match.end()
+    if not fields:
+        return None
+    if position < len(text):
+        parts.append(text[position:])
+    return tuple(parts), frozenset(fields)
+
+class TemplateCache:
+    # Compiled templates by content hash, so a body is parsed once however often it is shown
+    def __init__(self, size=TEMPLATE_CACHE_SIZE):
+        self.size = size
+        self.compiled = OrderedDict()
+
+    def expand(self, key, text, clipboard=lambda: ""):
+        if '{{' not in text:
+            return text
+        compiled = self.compiled.get(key)
+        if key in self.compiled:
+            self.compiled.move_to_end(key)
+        else:
+            compiled = self.compiled[key] = compile_template(text)
+            if len(self.compiled) > self.size:
+                self.compiled.popitem(last=False)
+        if compiled is None:
+            return text
+        parts, fields = compiled
+        now = datetime.now()
+        values = {field: now.strftime(TEMPLATE_FORMATS[field]) for field in fields if field in TEMPLATE_FORMATS}
+        if 'user' in fields:
+            values['user'] = getpass.getuser()
+        if 'clipboard' in fields:
+            values['clipboard'] = clipboard()
+        pieces = []
+        for part in parts:
+            if isinstance(part, str):
+                pieces.append(part)
+            elif part[1]:
+                try:
+                    pieces.append(now.strftime(part[1]))
+                except ValueError:
+                    pieces.append(part[2])
+            else:
+                pieces.append(values[part[0]])
+        return ''.join(pieces)
+
+# Characters that can be part of a compound word, as the body of a regex character class.
+# Add ':/?#=&%+~' for URLs or '\\/:' for paths through the "selection/word_chars" setting.
+DEFAULT_WORD_CHARS = r"A-Za-z0-9._\-@"
+
+# Annotations longer than this are rendered in chunks as the user scrolls towards the end
+LAZY_RENDER_CHARS = 200000
+LAZY_CHUNK_CHARS = 100000
+
+class SmartSelectMixin:
+    # Shared by the rich and plain-text editors; call _init_smart_select() from __init__
+    def _init_smart_select(self):
+        self.triple_click_mode = "line"  # or "segment": the run of non-blank lines around the click
+        self._last_double_click = None
+        self._tail = ""  # Text of a long annotation that has not been rendered yet
+        self.set_word_chars(DEFAULT_WORD_CHARS)
+        self.verticalScrollBar().valueChanged.connect(self._render_more)
+
+    def set_word_chars(self, word_chars):
+        try:
+            self._word_pattern = re.compile(f"[{word_chars}]+")
+        except re.error:
+            self._word_pattern = re.compile(f"[{DEFAULT_WORD_CHARS}]+")
+
     def mouseDoubleClickEvent(self, event):
         cursor = self.textCursor()
-        pos = cursor.position()
-        
-        # Select the initial word
-        cursor.select(QTextCursor.WordUnderCursor)
-        
-        # Get the full text and the initial selection
-        full_text = self.toPlainText()
-        start = cursor.selectionStart()
-        end = cursor.selectionEnd()
-        
-        # Define characters that can be part of a compound word
-        word_chars = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-@')
-        
-        # Expand left
-        while start > 0 and full_text[start-1] in word_chars:
-            start -= 1
-        
-        # Expand right
-        while end < len(full_text) and full_text[end] in word_chars:
-            end += 1
-        
-        # Set the new selection
-        cursor.setPosition(start)
-        cursor.setPosition(end, QTextCursor.KeepAnchor)
-        
+
+        # Only the block under the cursor is searched, so the cost does not depend on document size
+        block = cursor.block()
+        offset = cursor.position() - block.position()
+        for match in self._word_pattern.finditer(block.text()):
+            if match.start() > offset:
+                break
+            if match.end() >= offset:
+                cursor.setPosition(block.position() + match.start())
+                cursor.setPosition(block.position() + match.end(), QTextCursor.KeepAnchor)
+                break
+        else:
+            cursor.select(QTextCursor.WordUnderCursor)
+
+        self.setTextCursor(cursor)
+        self._last_double_click = (time.monotonic(), event.pos())
+
+    def mousePressEvent(self, event):
+        last, self._last_double_click = self._last_double_click, None
+        if (last is not None and event.button() == Qt.LeftButton
+                and (time.monotonic() - last[0]) * 1000 < QApplication.doubleClickInterval()
+                and (event.pos() - last[1]).manhattanLength() < QApplication.startDragDistance()):
+            self.select_enclosing()
+            return
+        super().mousePressEvent(event)
+
+    def select_enclosing(self):
+        cursor = self.textCursor()
+        first = last = cursor.block()
+        if self.triple_click_mode == "segment" and first.text().strip():
+            while first.previous().isValid() and first.previous().text().strip():
+                first = first.previous()
+            while last.next().isValid() and last.next().text().strip():
+                last = last.next()
+        cursor.setPosition(first.position())
+        cursor.setPosition(last.position() + last.length() - 1, QTextCursor.KeepAnchor)
         self.setTextCursor(cursor)
 
+    def set_display_text(self, text):
+        self._tail = ""
+        if len(text) > LAZY_RENDER_CHARS:
+            text, self._tail = self._split_chunk(text)
+        self.setPlainText(text)
+
+    def append_display_text(self, text):
+        # Appends at the end instead of re-setting the whole document
+        if self._tail:
+            self._tail += '\n' + text
+            self.textChanged.emit()  # The document is untouched, but the text did change
+            return
+        if not self.document().isEmpty():
+            text = '\n' + text
+        if len(text) > LAZY_RENDER_CHARS:
+            text, self._tail = self._split_chunk(text)
+        self._insert_at_end(text)
+
+    def full_text(self):
+        return self.toPlainText() + self._tail
+
+    def char_count(self):
+        return self.document().characterCount() - 1 + len(self._tail)
+
+    def clear(self):
+        self._tail = ""
+        super().clear()
+
+    def _split_chunk(self, text):
+        # Prefer to cut at a line break so wrapped lines are not split mid-way
+        cut = text.rfind('\n', 0, LAZY_CHUNK_CHARS) + 1 or LAZY_CHUNK_CHARS
+        return text[:cut], text[cut:]
+
+    def _insert_at_end(self, text):
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+
+    def _render_more(self, value):
+        scroll_bar = self.verticalScrollBar()
+        if self._tail and value >= scroll_bar.maximum() - scroll_bar.pageStep():
+            chunk, self._tail = self._split_chunk(self._tail)
+            self._insert_at_end(chunk)
+
+class SmartSelectTextEdit(SmartSelectMixin, QTextEdit):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._init_smart_select()
+
+class SmartSelectPlainTextEdit(SmartSelectMixin, QPlainTextEdit):
+    # Plain-text backend for the display: lays out per block, which stays fast on very large output
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._init_smart_select()
+
 class VersionHistoryDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -196,35 +2512,225 @@ Version 1.0 (Initial Release):
         """
         self.text_edit.setPlainText(history)
 
+DISPLAY_FONT_SIZE = 12
+DISPLAY_FONT_SIZE_MIN = 6
+DISPLAY_FONT_SIZE_MAX = 72
+UI_FONT_SIZE_MAX = 32
+
 class WheelEventFilter(QObject):
+    # Wheel deltas are summed and applied once per frame, so a fast flick is a single relayout
     def __init__(self, parent=None):
         super().__init__(parent)
+        self._pending_delta = 0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(16)
+        self._timer.timeout.connect(self.flush)
 
     def eventFilter(self, obj, event):
         if event.type() == QEvent.Wheel and event.modifiers() == Qt.ControlModifier:
-            delta = event.angleDelta().y()
-            if delta > 0:
-                self.parent().change_font_size(True)
-            else:
-                self.parent().change_font_size(False)
+            self._pending_delta += event.angleDelta().y()
+            if not self._timer.isActive():
+                self._timer.start()
             return True
         return False
 
+    def flush(self):
+        # 120 units is one notch; high-resolution wheels and touchpads send fractions of it
+        steps = int(self._pending_delta / 120)
+        if steps:
+            self._pending_delta -= steps * 120
+            self.parent().zoom_by(steps)
+
+# The GUI thread is reported as stalled once its heartbeat is this late (ms)
+STALL_THRESHOLD_MS = 500
+STALL_HEARTBEAT_MS = 100
+STALL_STACK_FRAMES = 15
+STALL_LOG_BYTES = 256 * 1024
+STALL_LOG_BACKUPS = 3
+
+class StallWatchdog(threading.Thread):
+    # The GUI thread stamps self.beat from a QTimer. When the stamp goes stale, this thread
+    # snapshots the main thread's Python stack and writes it, with the operation in progress,
+    # to a rotating log.
+    def __init__(self, log_path, threshold, describe):
+        super().__init__(name="StallWatchdog", daemon=True)
+        self.log_path = log_path
+        self.threshold = threshold  # seconds
+        self.describe = describe  # Called from this thread; returns the operation in progress
+        self.beat = time.monotonic()
+        self.stalls = 0
+        self._stop_event = threading.Event()
+        self.logger = logging.getLogger("AnnotAPP.stalls")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = RotatingFileHandler(log_path, maxBytes=STALL_LOG_BYTES, backupCount=STALL_LOG_BACKUPS,
+                                           encoding='utf-8', delay=True)
+        self.handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+
+    def start(self):
+        self.logger.addHandler(self.handler)
+        super().start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(1)
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def heartbeat(self):
+        self.beat = time.monotonic()
+
+    def run(self):
+        stalled_since = None
+        while not self._stop_event.wait(self.threshold / 4):
+            lag = time.monotonic() - self.beat
+            if lag < self.threshold:
+                if stalled_since is not None:
+                    self.logger.info(f"GUI recovered after {self.beat - stalled_since:.2f} s")
+                    stalled_since = None
+            elif stalled_since is None:
+                stalled_since = self.beat
+                self.report(lag)
+
+    def report(self, lag):
+        # One report per stall, taken while the GUI thread is still stuck
+        self.stalls += 1
+        frame = sys._current_frames().get(threading.main_thread().ident)
+        stack = ''.join(traceback.format_stack(frame, STALL_STACK_FRAMES)) if frame is not None else "  (no stack)\n"
+        try:
+            operation = self.describe()
+        except Exception as e:  # The GUI thread may be halfway through changing what describe() reads
+            operation = f"unknown ({e!r})"
+        self.logger.warning(f"GUI stalled {lag:.2f} s during {operation}\n{stack.rstrip()}")
+
+# Session state is written this long (ms) after the last change to it
+SESSION_SAVE_DELAY_MS = 1000
+# The display contents are kept in this file next to the workbook rather than in QSettings (the
+# registry on Windows); annotations shown in accumulative mode are appended to it
+SESSION_DISPLAY_FILE = "AnnotAPP.session.txt"
+
+# Rows handed from the loader thread to the window per batch
+LOAD_BATCH_ROWS = 1000
+# Batches parsed ahead of the window; the loader waits (and reads no further shards) beyond this
+LOAD_QUEUE_BATCHES = 8
+# While a library streams in, the grid is reflowed at most this often (ms) instead of every frame
+LOAD_REFLOW_INTERVAL = 250
+# Buttons shown while a library streams in, in file order; the full sorted grid is built once at the end
+LOAD_PREVIEW_BUTTONS = 300
+
+class LibraryLoader(QThread):
+    # Parses a workbook off the GUI thread; the window takes the batches from the queue at its own pace
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.batches = queue.Queue(LOAD_QUEUE_BATCHES)
+        self.error = None
+
+    def run(self):
+        batch = []
+        try:
+            if is_sharded_library(self.path):
+                self.load_shards(ShardedLibrary(self.path).shard_paths())
+                return
+            for row in iter_annotation_rows(self.path, "xlsx"):
+                batch.append(row)
+                if len(batch) >= LOAD_BATCH_ROWS:
+                    self.batches.put(batch)
+                    batch = []
+        except pd.errors.EmptyDataError:
+            pass  # Handle empty file
+        except Exception as e:
+            self.error = e
+        finally:
+            if batch:
+                self.batches.put(batch)
+
+    def load_shards(self, paths):
+        # Shards are read as the window takes their rows, so only a few are ever parsed ahead.
+        # Large libraries use worker processes, each parsing one shard ahead of the queue.
+        if sum(os.path.getsize(path) for path in paths if os.path.exists(path)) < SHARD_PARALLEL_BYTES:
+            for path in paths:
+                self.queue_rows(read_shard(path))
+            return
+        with ProcessPoolExecutor() as executor:
+            pending = deque()
+            paths = iter(paths)
+            for path in paths:
+                pending.append(executor.submit(read_shard, path))
+                if len(pending) >= (os.cpu_count() or 1):
+                    break
+            while pending:
+                rows = pending.popleft().result()
+                path = next(paths, None)
+                if path is not None:
+                    pending.append(executor.submit(read_shard, path))
+                self.queue_rows(rows)
+
+    def queue_rows(self, rows):
+        for start in range(0, len(rows), LOAD_BATCH_ROWS):
+            self.batches.put(rows[start:start + LOAD_BATCH_ROWS])
+
+class ButtonGridArea(QScrollArea):
+    # Scrollable home of the annotation grid; reports width changes so the grid can reflow
+    resized = pyqtSignal()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if event.size().width() != event.oldSize().width():
+            self.resized.emit()
+
 class AnnotApp(QMainWindow):
     def __init__(self):  
         super().__init__()
         self.setWindowIcon(QIcon(icon_path))
         self.setWindowTitle(f"Annot APP {VERSION}")
         self.accumulative_mode = False  # Start in non-accumulative mode
-        self.annotations = {}
         self.button_column = 0
         self.button_row = 0
         self.current_annotation = None
-        self.annotation_file = "annotations.xlsx"
         self.settings = QSettings("MyCompany", "AnnotApp")
+        # Mode, active set and geometry are snapshotted to QSettings shortly after they change, the
+        # display to SESSION_DISPLAY_FILE
+        self.session_timer = QTimer(self)
+        self.session_timer.setSingleShot(True)
+        self.session_timer.setInterval(SESSION_SAVE_DELAY_MS)
+        self.session_timer.timeout.connect(self.save_session)
+        self.session_saved = {}  # key -> value last written, so unchanged parts are not rewritten
+        self.session_display_dirty = False  # The display changed other than by appending; rewrite the file
+        self.session_display_appends = []  # Text appended since the last save, written with mode 'a'
+        self.session_display_path = None
+        self.session_ready = False  # Nothing is saved until the last session has been restored
+        self.duplicate_finder = None  # Built on first use
+        self.templates = TemplateCache()
+        self.shown_texts = {}  # name -> text as expanded into the display, for removing it again
+        self.operations = []  # Labels of the operations in progress, outermost first
+        self.watchdog = None
+        self.startup_timeline = {'import': STARTUP_IMPORTED - STARTUP_STARTED}
+        self.print_startup_timeline = False
+        self.library_loader = None
+        self.load_timer = QTimer(self)
+        self.load_timer.setInterval(0)  # One batch per event loop pass, so painting and input keep up
+        self.load_timer.timeout.connect(self.load_next_batch)
+
+        # Named collections, each backed by its own workbook; only the active one is loaded
+        self.collections = json.loads(self.settings.value("collections/files", json.dumps(DEFAULT_COLLECTIONS)))
+        self.active_collection = self.settings.value("collections/active", "Default")
+        if self.active_collection not in self.collections:
+            self.active_collection = next(iter(self.collections))
+        self.collection_index = CollectionIndex()
+        self.open_library(self.collections[self.active_collection])
         self.active_annotations = set()
+        self.api = None
 
-        self.display_text = SmartSelectTextEdit()
+        if self.settings.value("display/backend", "plain") == "rich":
+            self.display_text = SmartSelectTextEdit()
+        else:
+            self.display_text = SmartSelectPlainTextEdit()
+        # 0 keeps everything; otherwise the oldest lines are dropped once the display holds more
+        self.display_text.document().setMaximumBlockCount(self.settings.value("display/max_blocks", 0, type=int))
+        self.display_text.set_word_chars(self.settings.value("selection/word_chars", DEFAULT_WORD_CHARS))
+        self.display_text.triple_click_mode = self.settings.value("selection/triple_click", "line")
         self.wheel_event_filter = WheelEventFilter(self)
         self.display_text.viewport().installEventFilter(self.wheel_event_filter)
         
@@ -238,6 +2744,14 @@ class AnnotApp(QMainWindow):
         self.toggle_switch.stateChanged.connect(lambda state: self.toggle_mode(state))
         
         top_right_layout = QHBoxLayout()
+        self.collection_combo = QComboBox()
+        self.collection_combo.addItems(sorted(self.collections))
+        self.collection_combo.setCurrentText(self.active_collection)
+        self.collection_combo.activated[str].connect(self.switch_collection)
+        top_right_layout.addWidget(self.collection_combo)
+        # Quick bar with the most used annotations
+        self.quick_bar_layout = QHBoxLayout()
+        top_right_layout.addLayout(self.quick_bar_layout)
         top_right_layout.addStretch()
         top_right_layout.addWidget(self.toggle_switch)
         main_layout.addLayout(top_right_layout)
@@ -249,26 +2763,148 @@ class AnnotApp(QMainWindow):
 
         self.setup_mode_toggle()
         self.setup_clear_shortcut()
-
-        # Load annotations after UI setup
-        self.load_annotations()
+        self.setup_undo_shortcuts()
+        self.setup_search_shortcut()
 
         # Set window size and position
         self.resize(600, 400)
         self.center_window()
 
         self.display_text.textChanged.connect(self.update_char_count)
+        self.display_text.textChanged.connect(self.on_display_changed)
+        self.restore_session()
         self.update_char_count()
 
+        # The library streams in on a worker thread while the window paints
+        self.load_annotations()
+
+        if self.settings.value("api/enabled", False, type=bool):
+            self.start_api()
+        if self.settings.value("watchdog/enabled", False, type=bool):
+            self.start_watchdog()
+
+        self.base_ui_font_size = QApplication.font().pointSize()
+        self.zoom_steps = 0
+        self.set_zoom(self.settings.value("zoom/steps", 0, type=int), save=False)
+
+    def open_library(self, annotation_file):
+        # The store and everything kept next to its workbook; called again when switching collections
+        self.annotation_file = annotation_file
+        self.library_load_failed = False
+        base = os.path.splitext(annotation_file)[0]
+
+        # Undo history is capped by memory and entry count; both can be tuned through QSettings
+        undo_stack = UndoStack(max_bytes=self.settings.value("undo/max_mb", 16, type=int) * 1024 * 1024,
+                               max_entries=self.settings.value("undo/max_entries", 200, type=int))
+        # Bodies above the threshold are compressed in memory; 0 turns compression off
+        self.annotations = AnnotationStore(undo_stack, compress_threshold=self.settings.value(
+            "storage/compress_kb", COMPRESS_THRESHOLD // 1024, type=int) * 1024)
+
+        # Per-annotation revisions live next to the library file
+        self.revision_history = RevisionHistory(base + ".history.db")
+        self.annotations.listeners.append(self.record_revision)
+
+        # Change stamps for incremental export
+        self.change_tracker = ChangeTracker(base + ".changes.json")
+        self.change_tracker.load(annotation_file)
+        self.annotations.listeners.append(self.change_tracker.record)
+
+        self.tag_index = TagIndex(self.annotations)
+        self.annotations.listeners.append(self.tag_index.on_change)
+
+        # A sharded library only rewrites the shards whose annotations or tags changed
+        self.library = ShardedLibrary(annotation_file) if is_sharded_library(annotation_file) else None
+        if self.library is not None:
+            self.annotations.listeners.append(self.library.on_change)
+            self.tag_index.listeners.append(self.library.mark_dirty)
+
+        self.usage = UsageTracker(base + ".usage.json", top_n=self.settings.value("usage/quick_bar_size", 8, type=int))
+        self.usage.load()
+        self.annotations.listeners.append(self.usage.on_change)
+
+        self.stats = LibraryStats(self.annotations, self.usage)
+        self.annotations.listeners.append(self.stats.on_change)
+
+        self.annotations.listeners.append(lambda changes: self.collection_index.invalidate(self.active_collection))
+        self.annotations.listeners.append(self.on_store_changes)
+
+    def close_library(self):
+        if self.library_loader is not None:
+            self.finish_loading_now()
+        self.save_annotations_to_file()
+        self.change_tracker.save()
+        self.usage.save()
+        self.revision_history.close()
+
+    def switch_collection(self, name):
+        if name == self.active_collection or name not in self.collections:
+            return
+        with self.busy(f"Switch to collection '{name}'"):
+            self.close_library()
+            self.active_collection = name
+            self.settings.setValue("collections/active", name)
+            self.clear_display()
+            self.open_library(self.collections[name])
+            self.load_annotations()
+            self.update_buttons()
+        self.collection_combo.setCurrentText(name)
+
+    def new_collection(self):
+        name, ok = QInputDialog.getText(self, "New Collection", "Collection name:")
+        name = name.strip()
+        if not ok or not name:
+            return
+        if name in self.collections:
+            QMessageBox.warning(self, "Duplicate Name", "A collection with this name already exists.")
+            return
+        # Keep the workbook name filesystem safe; the display name can be anything
+        folder = os.path.dirname(self.collections[self.active_collection])
+        self.collections[name] = self.unused_collection_path(folder, re.sub(r'[^\w\- ]', '_', name))
+        self.settings.setValue("collections/files", json.dumps(self.collections))
+        self.collection_combo.clear()
+        self.collection_combo.addItems(sorted(self.collections))
+        self.switch_collection(name)
+
+    def unused_collection_path(self, folder, stem):
+        # Sidecar files are named after the workbook without its extension, so a stem already used
+        # by another collection or present on disk in either layout gets a numeric suffix
+        taken = {os.path.normcase(os.path.abspath(os.path.splitext(path)[0])) for path in self.collections.values()}
+        base = os.path.join(folder, stem)
+        suffix = 1
+        while (os.path.normcase(os.path.abspath(base)) in taken or os.path.exists(base + ".xlsx")
+               or os.path.exists(base + SHARDED_SUFFIX)):
+            suffix += 1
+            base = os.path.join(folder, f"{stem} {suffix}")
+        return base + ".xlsx"
+
+    def search_all_collections(self):
+        CollectionSearchDialog(self).exec_()
+
+    def collection_rows(self, collection):
+        # The active collection is read from memory, others are parsed from disk on demand
+        if collection == self.active_collection:
+            return self.annotations.items()
+        path = self.collections[collection]
+        if not os.path.exists(path):
+            return ()
+        return ((name, annotation) for name, annotation, *_ in iter_library_rows(path))
+
+    def collection_stamp(self, collection):
+        if collection == self.active_collection:
+            return None  # Kept current through invalidate()
+        path = self.collections[collection]
+        return os.path.getmtime(path) if os.path.exists(path) else 0
+
     def setup_display_area(self, main_layout):
         display_layout = QHBoxLayout()
 
         # Configure display text
-        self.display_text.setAcceptRichText(False)
-        self.display_text.setLineWrapMode(QTextEdit.WidgetWidth)
+        if isinstance(self.display_text, QTextEdit):
+            self.display_text.setAcceptRichText(False)
+        self.display_text.setLineWrapMode(self.display_text.WidgetWidth)
         
         # Set Consolas font
-        font = QFont("Consolas, Monaco, Monospace", 12)  # Fallback fonts included
+        font = QFont("Consolas, Monaco, Monospace", DISPLAY_FONT_SIZE)  # Fallback fonts included
         self.display_text.setFont(font)
         
         # Character count label
@@ -290,9 +2926,9 @@ class AnnotApp(QMainWindow):
         display_button_layout = QVBoxLayout()
         
         # Settings button
-        settings_button = QPushButton("Settings")
-        settings_button.clicked.connect(self.open_settings)
-        display_button_layout.addWidget(settings_button)
+        self.settings_button = QPushButton("Settings")
+        self.settings_button.clicked.connect(self.open_settings)
+        display_button_layout.addWidget(self.settings_button)
 
         # Copy button
         copy_button = QPushButton("COPY")
@@ -310,27 +2946,68 @@ class AnnotApp(QMainWindow):
         # Add the entire display layout to the main layout
         main_layout.addLayout(display_layout)
 
+    def show_search_result(self, collection, name):
+        self.switch_collection(collection)
+        if self.library_loader is not None:
+            self.finish_loading_now()  # The result has to be there to be shown
+        if name in self.annotations:
+            self.show_annotation(name)
+
     def update_char_count(self):
-        count = len(self.display_text.toPlainText())
+        count = self.display_text.char_count()
         self.char_count_label.setText(str(count))
 
     def setup_button_area(self, main_layout):
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("Filter: name  #tag  #tag1|tag2  -#tag")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.textChanged.connect(self.update_buttons)
+        main_layout.addWidget(self.filter_edit)
+
+        # Buttons are kept per name and moved between cells; the column count follows the width
+        self.grid_buttons = {}  # name -> button
+        self.grid_cells = {}  # name -> (row, column) the button currently occupies
+        self.grid_widths = {}  # name -> width the button asks for at the current font size
+        self.grid_names = []  # visible names in grid order
+        self.grid_columns = 0
+        self.reflow_timer = QTimer(self)
+        self.reflow_timer.setSingleShot(True)
+        self.reflow_timer.setInterval(16)  # At most one reflow per frame
+        self.reflow_timer.timeout.connect(self.reflow_buttons)
+
+        self.button_container = QWidget()
+        container_layout = QVBoxLayout(self.button_container)
+        container_layout.setContentsMargins(0, 0, 0, 0)
         self.button_layout = QGridLayout()
-        main_layout.addLayout(self.button_layout)
+        container_layout.addLayout(self.button_layout)
+        container_layout.addStretch()
+        self.button_area = ButtonGridArea()
+        self.button_area.setWidget(self.button_container)
+        self.button_area.setWidgetResizable(True)
+        self.button_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.button_area.setFrameShape(QScrollArea.NoFrame)
+        self.button_area.resized.connect(self.schedule_reflow)
+        main_layout.addWidget(self.button_area)
 
     def setup_bottom_area(self, main_layout):
         bottom_layout = QHBoxLayout()
 
         # Contributor Label
-        contributor_label = QLabel(f"Contributor: chenwayi@ | Version: {VERSION}")
-        contributor_label.mousePressEvent = self.show_version_history
-        bottom_layout.addWidget(contributor_label)
+        self.contributor_label = QLabel(f"Contributor: chenwayi@ | Version: {VERSION}")
+        self.contributor_label.mousePressEvent = self.show_version_history
+        bottom_layout.addWidget(self.contributor_label)
 
         # Always on Top Checkbox
         self.always_on_top_check = QCheckBox("Always on Top")
         self.always_on_top_check.stateChanged.connect(self.toggle_always_on_top)
         bottom_layout.addWidget(self.always_on_top_check)
 
+        # Usage-ordered grid
+        self.usage_order_check = QCheckBox("Most Used First")
+        self.usage_order_check.setChecked(self.settings.value("grid/usage_order", False, type=bool))
+        self.usage_order_check.stateChanged.connect(self.toggle_usage_order)
+        bottom_layout.addWidget(self.usage_order_check)
+
         main_layout.addLayout(bottom_layout)
 
     def setup_mode_toggle(self):
@@ -346,6 +3023,7 @@ class AnnotApp(QMainWindow):
             self.accumulative_mode = state
         
         self.update_mode_indicator()
+        self.schedule_session_save()
         
         # Update the toggle switch state
         self.toggle_switch.blockSignals(True)
@@ -362,74 +3040,274 @@ class AnnotApp(QMainWindow):
         clear_action.triggered.connect(self.clear_display)
         self.addAction(clear_action)
 
+    def setup_search_shortcut(self):
+        search_action = QAction('Search All Collections', self)
+        search_action.setShortcut('Ctrl+Shift+F')
+        search_action.triggered.connect(self.search_all_collections)
+        self.addAction(search_action)
+
+    def setup_undo_shortcuts(self):
+        # Plain Ctrl+Z stays with the text area's own editing undo
+        undo_action = QAction('Undo', self)
+        undo_action.setShortcut('Ctrl+Shift+Z')
+        undo_action.triggered.connect(self.undo_last_change)
+        self.addAction(undo_action)
+
+        redo_action = QAction('Redo', self)
+        redo_action.setShortcut('Ctrl+Shift+Y')
+        redo_action.triggered.connect(self.redo_last_change)
+        self.addAction(redo_action)
+
+    def undo_last_change(self):
+        self.annotations.undo()
+
+    def redo_last_change(self):
+        self.annotations.redo()
+
+    def on_store_changes(self, changes):
+        # One refresh per store transaction, however many annotations it touched. Edits that keep
+        # the set of names only need new tooltips; anything else regroups the grid once.
+        for old_name, new_name in changes.renamed.items():
+            if old_name in self.active_annotations:
+                self.active_annotations.discard(old_name)
+                self.active_annotations.add(new_name)
+            if old_name in self.shown_texts:
+                self.shown_texts[new_name] = self.shown_texts.pop(old_name)
+            if self.current_annotation == old_name:
+                self.current_annotation = new_name
+        if changes.reset or changes.removed:
+            self.active_annotations = {name for name in self.active_annotations if name in self.annotations}
+            for name in [name for name in self.shown_texts if name not in self.annotations]:
+                del self.shown_texts[name]
+            if self.current_annotation not in self.annotations:
+                self.current_annotation = None
+        if changes.reset or changes.added or changes.removed or changes.renamed:
+            self.update_buttons()
+        else:
+            for name in changes.changed:
+                if name in self.grid_buttons:
+                    self.update_button_tooltip(name)
+        self.update_button_states()
+
     def clear_display(self):
         self.display_text.clear()
         self.active_annotations.clear()
+        self.shown_texts.clear()
         self.update_button_states()  # No argument needed here
         self.current_annotation = None
 
     def reset_button_states(self):
-        for i in range(self.button_layout.count()):
-            button = self.button_layout.itemAt(i).widget()
+        for button in self.grid_buttons.values():
             button.setStyleSheet("")
 
     def update_buttons(self):
-        # Clear existing buttons
-        for i in reversed(range(self.button_layout.count())): 
-            widget = self.button_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.setParent(None)
-
-        # Add buttons in alphabetical order
-        sorted_names = sorted(self.annotations.keys())
-        for index, name in enumerate(sorted_names):
-            row = index // 4  # 4 buttons per row
-            col = index % 4
-            btn = QPushButton(name)
+        # Drop the buttons of annotations that no longer exist
+        for name in [name for name in self.grid_buttons if name not in self.annotations]:
+            self.remove_from_grid(name)
+            self.grid_buttons.pop(name).deleteLater()
+            self.grid_widths.pop(name, None)
+
+        # Alphabetical order, or by usage when enabled
+        if self.usage_order_check.isChecked():
+            sorted_names = self.usage.ordered(self.tag_index.query(self.filter_edit.text()))
+        else:
+            sorted_names = sorted(self.tag_index.query(self.filter_edit.text()))
+        visible = set(sorted_names)
+        for name in self.grid_names:
+            if name not in visible and name in self.grid_buttons:
+                self.remove_from_grid(name)
+                self.grid_buttons[name].hide()
+
+        for name in sorted_names:
+            self.grid_button(name)
+        self.grid_names = sorted_names
+        self.schedule_reflow()
+
+        self.update_quick_bar()
+
+    def grid_button(self, name):
+        btn = self.grid_buttons.get(name)
+        if btn is None:
+            btn = self.grid_buttons[name] = QPushButton(name, self.button_container)
+            btn.hide()  # Shown once reflow_buttons gives it a cell
+            # The column decides the width, so a very long name cannot widen the window
+            btn.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Fixed)
             btn.clicked.connect(lambda checked, n=name: self.show_annotation(n))
             btn.setContextMenuPolicy(Qt.CustomContextMenu)
             btn.customContextMenuRequested.connect(lambda pos, n=name: self.on_context_menu(pos, n))
-            self.button_layout.addWidget(btn, row, col)
+        self.update_button_tooltip(name)
+        return btn
+
+    def update_button_tooltip(self, name):
+        # Built from the record alone, so a large body is never decompressed for it; records
+        # are replaced on every change, so an unchanged one needs no new tooltip
+        btn = self.grid_buttons[name]
+        record = self.annotations.record(name)
+        tags = self.tag_index.tags_of(name)
+        if getattr(btn, 'tooltip_source', None) != (record, tags):
+            btn.tooltip_source = (record, tags)
+            btn.setToolTip("\n".join(filter(None, (
+                ", ".join(tags),
+                f"{record.length:,} characters, modified {format_timestamp(record.modified)}",
+                str(self.annotations.preview(name))[:120]))))
+
+    def remove_from_grid(self, name):
+        if self.grid_cells.pop(name, None) is not None:
+            self.button_layout.removeWidget(self.grid_buttons[name])
+
+    def schedule_reflow(self):
+        if not self.reflow_timer.isActive():
+            self.reflow_timer.start()
+
+    def reflow_buttons(self):
+        # As many equal columns as the widest visible button allows; only buttons whose cell
+        # changed are moved
+        names = self.grid_names
+        if not names:
+            return
+        for name in names:
+            if name not in self.grid_widths:
+                self.grid_widths[name] = self.grid_buttons[name].sizeHint().width()
+        spacing = max(0, self.button_layout.horizontalSpacing())
+        margins = self.button_layout.contentsMargins()
+        width = self.button_area.viewport().width() - margins.left() - margins.right()
+        cell_width = max(self.grid_widths[name] for name in names)
+        columns = max(1, min(len(names), (width + spacing) // (cell_width + spacing)))
+        if columns != self.grid_columns:
+            for column in range(max(columns, self.grid_columns)):
+                self.button_layout.setColumnStretch(column, 1 if column < columns else 0)
+            self.grid_columns = columns
+
+        moves = [(name, divmod(index, columns)) for index, name in enumerate(names)
+                 if self.grid_cells.get(name) != divmod(index, columns)]
+        bulk = len(moves) > len(self.grid_cells) // 4
+        if bulk:
+            # removeWidget searches the layout, so when most buttons move (a new column count,
+            # names inserted near the front) the layout is emptied from the end instead. Clearing
+            # WA_LaidOut keeps addWidget from searching for the button again, and with the
+            # container hidden showing a button does not relayout anything.
+            self.button_container.hide()
+            while self.button_layout.count():
+                self.button_layout.takeAt(self.button_layout.count() - 1).widget().setAttribute(Qt.WA_LaidOut, False)
+            self.grid_cells.clear()
+            moves = [(name, divmod(index, columns)) for index, name in enumerate(names)]
+        for name, cell in moves:
+            btn = self.grid_buttons[name]
+            self.remove_from_grid(name)
+            self.button_layout.addWidget(btn, *cell)
+            self.grid_cells[name] = cell
+            btn.show()
+        if bulk:
+            self.button_container.show()
+
+    def update_quick_bar(self):
+        for i in reversed(range(self.quick_bar_layout.count())):
+            self.quick_bar_layout.itemAt(i).widget().setParent(None)
+        for name in self.usage.top_names(self.annotations):
+            btn = QPushButton(name)
+            btn.setFlat(True)
+            btn.clicked.connect(lambda checked, n=name: self.show_annotation(n))
+            self.quick_bar_layout.addWidget(btn)
 
-        # Adjust window size
-        self.adjustSize()
+    def record_usage(self, names):
+        changed = False
+        for name in names:
+            self.stats.on_use(name)
+            changed = self.usage.touch(name) or changed
+        if changed:
+            self.update_quick_bar()
+
+    def toggle_usage_order(self, state):
+        self.settings.setValue("grid/usage_order", state == Qt.Checked)
+        self.update_buttons()
+        self.update_button_states()
 
     def on_context_menu(self, pos, name):
         context_menu = QMenu(self)
+        history_action = context_menu.addAction("History...")
+        tags_action = context_menu.addAction("Tags...")
+        rename_action = context_menu.addAction("Rename...")
+        # The new name could belong to a row that has not been read yet
+        rename_action.setEnabled(self.library_loader is None)
         remove_action = context_menu.addAction("Remove")
         action = context_menu.exec_(self.sender().mapToGlobal(pos))
         if action == remove_action:
             self.remove_annotation(name)
+        elif action == rename_action:
+            self.rename_annotation(name)
+        elif action == history_action:
+            RevisionHistoryDialog(self, name).exec_()
+        elif action == tags_action:
+            self.edit_tags(name)
+
+    def edit_tags(self, name):
+        tags, ok = QInputDialog.getText(self, "Tags", f"Tags for '{name}' (comma separated):",
+                                        text=", ".join(self.tag_index.tags_of(name)))
+        if ok:
+            self.tag_index.set_tags(name, tags.split(','))
+            self.update_buttons()
+            self.update_button_states()
+
+    def rename_annotation(self, name):
+        if self.library_loader is not None:
+            self.finish_loading_now()  # Every name has to be known before checking for a clash
+        new_name, ok = QInputDialog.getText(self, "Rename", f"New name for '{name}':", text=name)
+        new_name = new_name.strip()
+        if not ok or not new_name or new_name == name:
+            return
+        if new_name in self.annotations:
+            QMessageBox.warning(self, "Duplicate Name", "An annotation with this name already exists.")
+            return
+        self.annotations.rename(name, new_name)
+
+    def record_revision(self, changes):
+        # One database commit per store transaction, so a bulk import is written at once
+        for name in changes.names():
+            self.revision_history.record(name, *changes.texts(name))
+        self.revision_history.commit()
+
+    def restore_revision(self, name, text):
+        self.annotations.set(name, text)
+        if not self.accumulative_mode and name in self.active_annotations:
+            self.show_annotation(name)
 
     def remove_annotation(self, name):
         if name in self.annotations:
-            annotation_text = self.annotations[name]
-            del self.annotations[name]
+            annotation_text = self.shown_texts.pop(name, None) or self.annotations[name]
+            self.annotations.remove(name)
             if self.accumulative_mode:
-                current_text = self.display_text.toPlainText()
+                current_text = self.display_text.full_text()
                 if annotation_text in current_text:
                     new_text = current_text.replace(annotation_text, '', 1)
-                    self.display_text.setPlainText(new_text.strip())
-            self.active_annotations.discard(name)
-            self.update_buttons()
-            self.update_button_states()  # No argument needed here
+                    self.display_text.set_display_text(new_text.strip())
 
     def show_annotation(self, name):
+        # Placeholders are filled in here; the store keeps the raw template for editing and export
+        text = self.templates.expand(self.annotations.hash_of(name), self.annotations[name],
+                                     lambda: QApplication.clipboard().text())
         if self.accumulative_mode:
-            current_text = self.display_text.toPlainText()
-            if current_text:
-                current_text += '\n'
-            self.display_text.setPlainText(current_text + self.annotations[name])
+            appended = ('\n' if self.display_text.char_count() else '') + text
+            # With a block limit (display/max_blocks) the document drops its oldest lines, so the
+            # file has to be rewritten to match
+            clean = not self.session_display_dirty and not self.display_text.document().maximumBlockCount()
+            self.display_text.append_display_text(text)
+            if clean:
+                # textChanged marked the display dirty; an append only needs adding to the file
+                self.session_display_dirty = False
+                self.session_display_appends.append(appended)
             self.active_annotations.add(name)
         else:
-            self.display_text.setPlainText(self.annotations[name])
+            self.display_text.set_display_text(text)
             self.active_annotations = {name}
+            self.shown_texts.clear()
+        self.shown_texts[name] = text
         self.update_button_states()  # No argument needed here
         self.current_annotation = name
+        self.record_usage((name,))
 
     def update_button_states(self):
-        for i in range(self.button_layout.count()):
-            button = self.button_layout.itemAt(i).widget()
+        self.schedule_session_save()  # Called whenever the active set may have changed
+        for button in self.grid_buttons.values():
             if button.text() in self.active_annotations:
                 button.setStyleSheet("background-color: lightblue;")
             else:
@@ -471,38 +3349,140 @@ class AnnotApp(QMainWindow):
         result = edit_dialog.exec_()
         if result == QDialog.Accepted:
             # Update annotations with new content
-            for name, text_edit in text_edits.items():
-                new_content = text_edit.toPlainText()
-                if new_content != self.annotations[name]:
-                    self.annotations[name] = new_content
+            with self.annotations.transaction("Edit All"):
+                for name, text_edit in text_edits.items():
+                    new_content = text_edit.toPlainText()
+                    if new_content != self.annotations[name]:
+                        self.annotations.set(name, new_content)
 
-            self.update_buttons()
-            self.adjustSize()
             QMessageBox.information(self, "Success", "All annotations have been updated.")
 
+    def start_api(self):
+        port = self.settings.value("api/port", API_DEFAULT_PORT, type=int)
+        self.api = AnnotationApi(lambda: self.annotations, MainThreadDispatcher(self), self.api_put, port)
+        try:
+            self.api.start()
+        except OSError as e:
+            self.api = None
+            QMessageBox.warning(self, "Local API", f"Could not listen on port {port}: {e}")
+
+    def toggle_api(self):
+        if self.api:
+            self.api.stop()
+            self.api = None
+        else:
+            self.start_api()
+        self.settings.setValue("api/enabled", self.api is not None)
+        if self.api:
+            QMessageBox.information(self, "Local API", f"Serving annotations on http://127.0.0.1:{self.api.port}")
+
+    def start_watchdog(self):
+        log_path = os.path.join(os.path.dirname(os.path.abspath(self.annotation_file)), "AnnotAPP.stalls.log")
+        threshold = self.settings.value("watchdog/threshold_ms", STALL_THRESHOLD_MS, type=int) / 1000
+        self.watchdog = StallWatchdog(log_path, threshold, self.describe_operation)
+        self.heartbeat_timer = QTimer(self)
+        self.heartbeat_timer.timeout.connect(self.watchdog.heartbeat)
+        self.heartbeat_timer.start(STALL_HEARTBEAT_MS)
+        self.watchdog.start()
+
+    def stop_watchdog(self):
+        self.heartbeat_timer.stop()
+        self.watchdog.stop()
+        self.watchdog = None
+
+    def toggle_watchdog(self):
+        if self.watchdog:
+            self.stop_watchdog()
+        else:
+            self.start_watchdog()
+            QMessageBox.information(self, "Stall Watchdog", f"Freezes are logged to {self.watchdog.log_path}")
+        self.settings.setValue("watchdog/enabled", self.watchdog is not None)
+
+    @contextmanager
+    def busy(self, label):
+        # Names what the GUI thread is doing, for stall reports
+        self.operations.append(label)
+        try:
+            yield
+        finally:
+            self.operations.pop()
+
+    def describe_operation(self):
+        operations = " > ".join(tuple(self.operations)) or "idle event loop"
+        return f"{operations} [{self.active_collection}: {len(self.annotations)} annotations]"
+
+    def api_put(self, name, text):
+        created = name not in self.annotations
+        self.annotations.set(name, text)
+        if not created and not self.accumulative_mode and name in self.active_annotations:
+            self.show_annotation(name)
+
+    def find_replace(self):
+        FindReplaceDialog(self).exec_()
+
+    def apply_replacements(self, results, pattern, replacement):
+        # One undo record and one refresh for the whole batch
+        with self.annotations.transaction("Replace"):
+            for name, old_text, new_text, count, preview in results:
+                current = self.annotations.get(name)
+                if current is None:
+                    continue
+                if current is not old_text:
+                    # Edited since the preview ran; redo the replacement on the current text
+                    new_text = pattern.sub(replacement, current)
+                self.annotations.set(name, new_text)
+        shown = [name for name in self.active_annotations if name in self.annotations]
+        if not self.accumulative_mode and shown:
+            self.show_annotation(shown[0])
+
     def open_settings(self):
         settings_dialog = QDialog(self)
         settings_dialog.setWindowTitle("Settings")
-        settings_dialog.setFixedSize(180, 220)  # Increased height to accommodate the new button
+        settings_dialog.setFixedWidth(180)
 
         layout = QVBoxLayout(settings_dialog)
 
         buttons = [
             ("Add", self.add_annotation_button),
             ("Edit All", self.edit_all_annotations),
+            ("Find/Replace", self.find_replace),
             ("Delete", self.delete_annotation),
             ("Import", self.import_annotations),
+            ("Import Folder", self.import_folder),
             ("Export", self.export_annotations),
-            ("Remove All", self.remove_all_annotations)
+            ("Export Changes", self.export_changes),
+            ("Export Patch", self.export_patch),
+            ("Find Duplicates", self.find_duplicates),
+            ("Statistics", self.show_statistics),
+            ("Storage Stats", self.show_storage_stats),
+            ("New Collection", self.new_collection),
+            ("Convert to Sharded Library", self.convert_to_shards),
+            ("Search All", self.search_all_collections),
+            ("Stop Local API" if self.api else "Start Local API", self.toggle_api),
+            ("Stop Stall Watchdog" if self.watchdog else "Start Stall Watchdog", self.toggle_watchdog),
+            ("Remove All", self.remove_all_annotations),
+            ("Undo", self.undo_last_change),
+            ("Redo", self.redo_last_change)
         ]
 
+        history_labels = {"Undo": self.annotations.undo_stack.undo_label(),
+                          "Redo": self.annotations.undo_stack.redo_label()}
+
         for text, command in buttons:
             button = QPushButton(text)
-            button.clicked.connect(command)
+            button.clicked.connect(lambda checked, text=text, command=command: self.run_action(text, command))
+            if text in history_labels:
+                # Name the change the button would revert/replay
+                button.setEnabled(history_labels[text] is not None)
+                button.setToolTip(history_labels[text] or "")
             layout.addWidget(button)
 
         settings_dialog.exec_()
 
+    def run_action(self, label, command):
+        with self.busy(label):
+            command()
+
     def add_annotation_button(self):
         dialog = QDialog(self)
         dialog.setWindowTitle("Create Annotation")
@@ -521,31 +3501,43 @@ class AnnotApp(QMainWindow):
         text_layout.addWidget(self.text_entry)
         layout.addLayout(text_layout)
 
+        tags_layout = QHBoxLayout()
+        tags_layout.addWidget(QLabel("Tags:"))
+        self.tags_entry = QLineEdit()
+        self.tags_entry.setPlaceholderText("comma separated")
+        tags_layout.addWidget(self.tags_entry)
+        layout.addLayout(tags_layout)
+
         save_button = QPushButton("Save")
         save_button.clicked.connect(lambda: self.save_annotation(dialog))
         layout.addWidget(save_button)
 
         dialog.exec_()
 
-    def save_annotation(self, dialog, name=None, text=None):
+    def save_annotation(self, dialog, name=None, text=None, tags=()):
         if name is None or text is None:
             name = self.name_entry.text().strip()
             text = self.text_entry.toPlainText().strip()
+            tags = self.tags_entry.text().split(',')
         if name and text:
             if name in self.annotations:
                 QMessageBox.warning(self, "Duplicate Name", "An annotation with this name already exists. Please choose a different name.")
                 return
-            self.annotations[name] = text
-            self.update_buttons()
+            # Tags go in before the grid hears about the new button
+            with self.annotations.transaction(f"Add '{name}'"):
+                self.annotations.set(name, text)
+                if tags:
+                    self.tag_index.set_tags(name, tags)
             if dialog:
                 dialog.accept()
         elif dialog:
             QMessageBox.warning(self, "Invalid Input", "Both name and annotation text must be provided.")
 
     def copy_annotation(self):
-        annotation_text = self.display_text.toPlainText().strip()
+        annotation_text = self.display_text.full_text().strip()
         if annotation_text:
             QApplication.clipboard().setText(annotation_text, mode=QClipboard.Clipboard)
+            self.record_usage(self.active_annotations)
 
     def delete_annotation(self):
         if self.current_annotation:
@@ -553,10 +3545,8 @@ class AnnotApp(QMainWindow):
                                            f"Are you sure you want to delete the annotation '{self.current_annotation}'?",
                                            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if confirm == QMessageBox.Yes:
-                del self.annotations[self.current_annotation]
-                self.update_buttons()
-                self.show_annotation(None)
-                self.display_text.clear()
+                self.annotations.remove(self.current_annotation)
+                self.clear_display()
         else:
             QMessageBox.information(self, "No Selection", "Please select an annotation to delete.")
 
@@ -565,69 +3555,437 @@ class AnnotApp(QMainWindow):
                                        QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if confirm == QMessageBox.Yes:
             self.annotations.clear()
-            self.update_buttons()
-            self.show_annotation(None)
-            self.display_text.clear()
+            self.clear_display()
 
     def import_annotations(self):
-        filepath, _ = QFileDialog.getOpenFileName(self, "Import Annotations", "", "Excel files (*.xlsx)")
+        filepath, selected_filter = QFileDialog.getOpenFileName(self, "Import Annotations", "",
+                                                                f"{IMPORT_FILTERS};;{CHANGESET_FILTER}")
         if filepath:
             try:
-                df = pd.read_excel(filepath)
-                if 'Name' not in df.columns or 'Annotation' not in df.columns:
-                    raise ValueError("Excel file must have 'Name' and 'Annotation' columns")
-                for index, row in df.iterrows():
-                    name = row['Name']
-                    annotation = row['Annotation']
-                    if name in self.annotations:
-                        overwrite = QMessageBox.question(self, "Overwrite?", f"Annotation '{name}' already exists. Overwrite?",
-                                                        QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
-                        if overwrite == QMessageBox.No:
-                            continue
-                    self.annotations[name] = annotation
-                self.update_buttons()
+                if is_changeset(filepath):
+                    skipped = self.apply_changeset(filepath)
+                    if skipped:
+                        QMessageBox.warning(self, "Changes Applied",
+                                            f"{skipped} deletion(s) were skipped because the annotation was edited locally.")
+                        return
+                else:
+                    fmt = annotation_format(filepath, selected_filter)
+                    self.merge_annotations(iter_annotation_rows(filepath, fmt))
                 QMessageBox.information(self, "Success", "Annotations imported successfully!")
             except Exception as e:
                 QMessageBox.critical(self, "Error", str(e))
 
+    def import_folder(self):
+        root = QFileDialog.getExistingDirectory(self, "Import Folder")
+        if not root:
+            return
+        relpaths = [os.path.relpath(os.path.join(folder, filename), root)
+                    for folder, _, filenames in os.walk(root)
+                    for filename in filenames if filename.lower().endswith(FOLDER_IMPORT_EXTENSIONS)]
+        if not relpaths:
+            QMessageBox.information(self, "Import Folder", "No .txt or .md files found.")
+            return
+
+        progress = QProgressDialog("Importing files...", "Cancel", 0, len(relpaths), self)
+        progress.setWindowModality(Qt.WindowModal)
+        self.folder_import_failed = self.folder_import_empty = 0
+        try:
+            with ProcessPoolExecutor() as executor:
+                futures = [executor.submit(read_text_files, root, relpaths[i:i + FOLDER_IMPORT_BATCH])
+                           for i in range(0, len(relpaths), FOLDER_IMPORT_BATCH)]
+                with self.annotations.transaction("Import Folder"):
+                    imported = self.merge_annotations(self.collect_folder_rows(futures, progress))
+        except Exception as e:
+            progress.close()
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        # Read before closing: closing the dialog counts as cancelling it
+        canceled = progress.wasCanceled()
+        progress.close()
+        if not canceled:
+            message = f"Imported {imported} file(s)."
+            if self.folder_import_failed:
+                message += f" {self.folder_import_failed} file(s) could not be read."
+            if self.folder_import_empty:
+                message += f" {self.folder_import_empty} empty file(s) were skipped."
+            QMessageBox.information(self, "Success", message)
+
+    def collect_folder_rows(self, futures, progress):
+        # Hand batches to the store as workers finish them, keeping the progress dialog alive
+        done = 0
+        for future in as_completed(futures):
+            if progress.wasCanceled():
+                for pending in futures:
+                    pending.cancel()
+                return
+            rows, failed, empty = future.result()
+            self.folder_import_failed += failed
+            self.folder_import_empty += empty
+            done += FOLDER_IMPORT_BATCH
+            progress.setValue(min(done, progress.maximum()))
+            yield from rows
+
+    def apply_changeset(self, filepath):
+        # Entries whose base hash matches are applied directly; diverged puts go through the
+        # usual overwrite prompt and diverged deletes are skipped. Returns the number skipped.
+        conflicts = []
+        skipped = 0
+        with self.annotations.transaction("Apply Changes"):
+            for entry in read_changeset(filepath):
+                name = entry['Name']
+                current = self.annotations.hash_of(name) if name in self.annotations else None
+                if entry['op'] == 'put':
+                    if current == entry['hash']:
+                        continue  # Already applied
+                    if current == entry['base']:
+                        self.annotations.set(name, entry['Annotation'])
+                    else:
+                        conflicts.append((name, entry['Annotation'], None, None, None))
+                elif current is not None:
+                    if current == entry['base']:
+                        self.annotations.remove(name)
+                    else:
+                        skipped += 1
+            self.merge_annotations(conflicts)
+        return skipped
+
+    def merge_annotations(self, rows):
+        # Conflict handling shared by every import format; returns how many rows were applied
+        overwrite_all = None
+        applied = 0
+        with self.annotations.transaction("Import"):
+            for name, annotation, tags, created, modified in rows:
+                if name in self.annotations:
+                    if overwrite_all is None:
+                        overwrite = QMessageBox.question(self, "Overwrite?", f"Annotation '{name}' already exists. Overwrite?",
+                                                         QMessageBox.Yes | QMessageBox.No | QMessageBox.YesToAll | QMessageBox.NoToAll,
+                                                         QMessageBox.No)
+                        if overwrite in (QMessageBox.YesToAll, QMessageBox.NoToAll):
+                            overwrite_all = overwrite == QMessageBox.YesToAll
+                        if overwrite in (QMessageBox.No, QMessageBox.NoToAll):
+                            continue
+                    elif not overwrite_all:
+                        continue
+                self.annotations.set(name, annotation, created, modified)
+                if tags is not None:
+                    self.tag_index.set_tags(name, tags)
+                applied += 1
+        return applied
+
     def export_annotations(self):
-        filepath, _ = QFileDialog.getSaveFileName(self, "Export Annotations", "", "Excel files (*.xlsx)")
+        filepath, selected_filter = QFileDialog.getSaveFileName(self, "Export Annotations", "", EXPORT_FILTERS)
         if filepath:
             try:
-                df = pd.DataFrame(list(self.annotations.items()), columns=['Name', 'Annotation'])
-                df.to_excel(filepath, index=False)
+                fmt = annotation_format(filepath, selected_filter)
+                if not os.path.splitext(filepath)[1]:
+                    filepath += ANNOTATION_FORMATS[fmt][1][0]
+                write_annotations(filepath, fmt, self.export_rows())
+                self.change_tracker.mark_exported(self.annotations)
+                self.change_tracker.save()
                 QMessageBox.information(self, "Success", "Annotations exported successfully!")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to export annotations: {e}")
 
+    def export_changes(self):
+        # Only what was added, changed or deleted since the last export
+        filepath = self.ask_changeset_path("Export Changes")
+        if filepath:
+            try:
+                puts, deletes = self.change_tracker.changes(self.annotations)
+                write_changeset(filepath, puts, deletes)
+                self.change_tracker.mark_exported(self.annotations, puts, deletes)
+                self.change_tracker.save()
+                QMessageBox.information(self, "Success", f"Exported {len(puts)} changed and {len(deletes)} deleted annotation(s).")
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"Failed to export changes: {e}")
+
+    def export_patch(self):
+        # Changes relative to an earlier export file, compared by content hash
+        base_path, selected_filter = QFileDialog.getOpenFileName(self, "Previous Export", "", IMPORT_FILTERS)
+        if not base_path:
+            return
+        filepath = self.ask_changeset_path("Export Patch")
+        if filepath:
+            try:
+                base_hashes = {name: content_hash(annotation) for name, annotation, *_
+                               in iter_annotation_rows(base_path, annotation_format(base_path, selected_filter))}
+                puts, deletes = diff_against_hashes(self.annotations, base_hashes)
+                write_changeset(filepath, puts, deletes)
+                QMessageBox.information(self, "Success", f"Exported {len(puts)} changed and {len(deletes)} deleted annotation(s).")
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"Failed to export patch: {e}")
+
+    def find_duplicates(self):
+        threshold = self.settings.value("duplicates/threshold", 0.8, type=float)
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            if self.duplicate_finder is None:
+                self.duplicate_finder = NearDuplicateFinder()
+            clusters = self.duplicate_finder.clusters(self.annotations, threshold)
+        finally:
+            QApplication.restoreOverrideCursor()
+        DuplicateReportDialog(self, clusters, threshold).exec_()
+
+    def show_statistics(self):
+        snapshot = self.stats.snapshot()
+        snapshot['collection'] = self.active_collection
+        LibraryStatsDialog(self, snapshot).exec_()
+
+    def show_storage_stats(self):
+        stats = self.annotations.compression_stats()
+        ratio = stats['compressed_bytes'] / stats['raw_chars'] if stats['raw_chars'] else 1.0
+        QMessageBox.information(self, "Storage Stats", "\n".join((
+            f"Compressed: {stats['compressed']} of {stats['total']} annotation(s)",
+            f"Size: {stats['raw_chars']:,} characters -> {stats['compressed_bytes']:,} bytes ({ratio:.0%})",
+            f"Compression time: {stats['compress_seconds'] * 1000:.1f} ms",
+            f"Decompression time: {stats['decompress_seconds'] * 1000:.1f} ms",
+            f"Decompressed cache: {stats['cached_chars']:,} characters")))
+
+    def export_rows(self):
+        return annotation_rows(self.annotations, self.tag_index.tags_of)
+
+    def ask_changeset_path(self, title):
+        filepath, _ = QFileDialog.getSaveFileName(self, title, "", CHANGESET_FILTER)
+        if filepath and not filepath.lower().endswith(('.jsonl', '.ndjson')):
+            filepath += CHANGESET_SUFFIX
+        return filepath
+
     def load_annotations(self):
-        if os.path.exists(self.annotation_file):
+        # Parsing runs on a LibraryLoader thread; load_next_batch adds its rows between events.
+        # Settings stays disabled until the whole library is in, so nothing can clear or
+        # overwrite it halfway.
+        if not os.path.exists(self.annotation_file):
+            self.finish_loading()
+            return
+        self.library_loader = LibraryLoader(self.annotation_file)
+        self.library_loader.start()
+        self.settings_button.setEnabled(False)
+        self.reflow_timer.setInterval(LOAD_REFLOW_INTERVAL)
+        self.load_timer.start()
+
+    def load_next_batch(self):
+        loader = self.library_loader
+        finished = loader.isFinished()  # Checked first: once finished, every batch is queued
+        try:
+            batch = loader.batches.get_nowait()
+        except queue.Empty:
+            if finished:
+                self.finish_loading()
+            return
+        with self.busy("Load library"):
+            self.add_loaded_rows(batch)
+
+    def finish_loading_now(self):
+        # Closing or switching mid-load: take everything the parser produces until it is done. The
+        # queue is bounded, so it has to be drained while waiting.
+        loader = self.library_loader
+        rows = []
+        while not (loader.isFinished() and loader.batches.empty()):
+            try:
+                rows.extend(loader.batches.get(timeout=0.05))
+            except queue.Empty:
+                pass
+        self.add_loaded_rows(rows)
+        self.finish_loading()
+
+    def add_loaded_rows(self, rows):
+        tags_by_name = {}
+        added = []
+        with self.annotations.recording_suspended():
+            for name, annotation, tags, created, modified in rows:
+                if name in self.annotations:
+                    continue  # First row wins, as do annotations added while loading
+                self.annotations.set(name, annotation, created, modified)
+                added.append(name)
+                if tags:
+                    tags_by_name[name] = tags
+        # Every step here is proportional to the batch, not to what has been loaded so far
+        self.stats.add_names(added)
+        self.tag_index.add_names(added, tags_by_name)
+        if self.library is not None:
+            self.library.add_names(added)
+        room = LOAD_PREVIEW_BUTTONS - len(self.grid_names)
+        if room > 0:
+            shown = list(self.tag_index.query(self.filter_edit.text(), added))[:room]
+            for name in shown:
+                self.grid_button(name)
+            self.grid_names = list(self.grid_names) + shown
+            self.schedule_reflow()
+
+    def finish_loading(self):
+        self.load_timer.stop()
+        self.reflow_timer.setInterval(16)
+        loader, self.library_loader = self.library_loader, None
+        self.settings_button.setEnabled(True)
+        self.collection_index.invalidate(self.active_collection)
+        # Reconcile the restored session with what was actually loaded
+        self.active_annotations = {name for name in self.active_annotations if name in self.annotations}
+        if self.current_annotation not in self.annotations:
+            self.current_annotation = None
+        self.update_buttons()
+        self.update_button_states()
+        if loader is not None and loader.error is not None:
+            # Saving now would replace the workbook with whatever part of it was read
+            self.library_load_failed = True
+            QMessageBox.critical(self, "Error", f"Failed to load annotations: {loader.error}")
+        if 'loaded' not in self.startup_timeline:
+            self.startup_timeline['loaded'] = time.perf_counter() - STARTUP_STARTED
+            self.report_startup_timeline()
+
+    def restore_session(self):
+        # Runs before the library loads; names that turn out to be gone are dropped in finish_loading
+        geometry = self.settings.value("session/geometry")
+        if geometry is not None:
+            self.restoreGeometry(geometry)
+        self.toggle_mode(self.settings.value("session/accumulative", False, type=bool))
+        self.settings.remove("session/display")  # Kept in QSettings by earlier versions
+        self.session_display_path = os.path.join(os.path.dirname(os.path.abspath(self.annotation_file)),
+                                                 SESSION_DISPLAY_FILE)
+        try:
+            with open(self.session_display_path, encoding='utf-8', newline='') as f:
+                self.display_text.set_display_text(f.read())
+        except UnicodeDecodeError:
             try:
-                df = pd.read_excel(self.annotation_file)
-                for index, row in df.iterrows():
-                    self.save_annotation(None, row['Name'], row['Annotation'])
-            except pd.errors.EmptyDataError:
-                pass  # Handle empty file
+                os.remove(self.session_display_path)  # Later appends must not land after unreadable text
+            except OSError:
+                pass
+        except OSError:
+            pass
+        self.active_annotations = set(json.loads(self.settings.value("session/active", "[]")))
+        self.current_annotation = self.settings.value("session/current", "") or None
+        self.session_display_dirty = False
+        self.session_display_appends.clear()
+        self.session_ready = True
+
+    def on_display_changed(self):
+        self.session_display_dirty = True
+        self.schedule_session_save()
+
+    def schedule_session_save(self):
+        if self.session_ready and not self.session_timer.isActive():
+            self.session_timer.start()
+
+    def save_session(self):
+        state = {
+            "session/accumulative": self.accumulative_mode,
+            "session/active": json.dumps(sorted(map(str, self.active_annotations))),
+            "session/current": str(self.current_annotation or ""),
+            "session/geometry": bytes(self.saveGeometry()),
+        }
+        # The display is only re-read when it changed other than by appending
+        try:
+            if self.session_display_dirty:
+                write_file_atomic(self.session_display_path, self.write_session_display)
+            elif self.session_display_appends:
+                with open(self.session_display_path, 'a', encoding='utf-8', newline='') as f:
+                    f.writelines(self.session_display_appends)
+        except OSError:
+            pass  # Losing the restored display is not worth interrupting the user over
+        self.session_display_dirty = False
+        self.session_display_appends.clear()
+        for key, value in state.items():
+            if self.session_saved.get(key) != value:
+                self.settings.setValue(key, value)
+                self.session_saved[key] = value
+
+    def write_session_display(self, path):
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(self.display_text.full_text())
+
+    def moveEvent(self, event):
+        super().moveEvent(event)
+        self.schedule_session_save()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.schedule_session_save()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if 'first_paint' not in self.startup_timeline:
+            self.startup_timeline['first_paint'] = time.perf_counter() - STARTUP_STARTED
+            self.report_startup_timeline()
+
+    def report_startup_timeline(self):
+        # Seconds since the process started importing; reported once both milestones are in
+        timeline = self.startup_timeline
+        if 'first_paint' not in timeline or 'loaded' not in timeline:
+            return
+        text = (f"Startup: import {timeline['import']:.2f} s, first paint {timeline['first_paint']:.2f} s, "
+                f"fully loaded {timeline['loaded']:.2f} s ({len(self.annotations)} annotations)")
+        self.contributor_label.setToolTip(text)
+        if self.print_startup_timeline:
+            print(text, flush=True)
 
     def save_annotations_to_file(self):
-        if self.annotations:
-            df = pd.DataFrame(list(self.annotations.items()), columns=['Name', 'Annotation'])
-            df.to_excel(self.annotation_file, index=False)
+        if self.library_load_failed:
+            return
+        if self.library is not None:
+            self.library.save(self.annotations, self.tag_index.tags_of)
+        elif self.annotations:
+            write_xlsx(self.annotation_file, self.export_rows())
+
+    def convert_to_shards(self):
+        # Writes the active collection as a sharded library next to its workbook and switches the
+        # collection over to it; the workbook itself is left in place
+        if self.library is not None:
+            QMessageBox.information(self, "Sharded Library", "This collection is already sharded.")
+            return
+        path = os.path.splitext(self.annotation_file)[0] + SHARDED_SUFFIX
+        if os.path.exists(path):
+            QMessageBox.warning(self, "Sharded Library", f"'{path}' already exists.")
+            return
+        try:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                ShardedLibrary.create(path, shard_count_for(len(self.annotations))).save(self.annotations, self.tag_index.tags_of)
+            finally:
+                QApplication.restoreOverrideCursor()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to write sharded library: {e}")
+            return
+        self.close_library()
+        self.collections[self.active_collection] = path
+        self.settings.setValue("collections/files", json.dumps(self.collections))
+        self.clear_display()
+        self.open_library(path)
+        self.load_annotations()
+        self.update_buttons()
+        QMessageBox.information(self, "Sharded Library", f"'{self.active_collection}' is now stored in {path}")
 
     def toggle_always_on_top(self, state):
         self.setWindowFlag(Qt.WindowStaysOnTopHint, state == Qt.Checked)
         self.show()
 
     def change_font_size(self, increase):
+        self.zoom_by(1 if increase else -1)
+
+    def zoom_by(self, steps):
+        self.set_zoom(self.zoom_steps + steps)
+
+    def set_zoom(self, steps, save=True):
+        # Steps are relative to the default sizes; the display keeps its 6-72 pt range
+        steps = max(DISPLAY_FONT_SIZE_MIN - DISPLAY_FONT_SIZE, min(steps, DISPLAY_FONT_SIZE_MAX - DISPLAY_FONT_SIZE))
+        if steps == self.zoom_steps and save:
+            return
+        self.zoom_steps = steps
+
         current_font = self.display_text.font()
-        size = current_font.pointSize()
-        if increase:
-            size = min(size + 1, 72)  # Max font size of 72
-        else:
-            size = max(size - 1, 6)   # Min font size of 6
-        current_font.setPointSize(size)
+        current_font.setPointSize(DISPLAY_FONT_SIZE + steps)
         self.display_text.setFont(current_font)
 
+        # The application font covers the button grid and every dialog opened afterwards
+        ui_font = QApplication.font()
+        ui_font.setPointSize(max(6, min(self.base_ui_font_size + steps, UI_FONT_SIZE_MAX)))
+        QApplication.setFont(ui_font)
+
+        # Button widths change with the font
+        self.grid_widths.clear()
+        self.schedule_reflow()
+
+        if save:
+            self.settings.setValue("zoom/steps", steps)
+
     def center_window(self):
         qr = self.frameGeometry()
         cp = QApplication.desktop().availableGeometry().center()
@@ -635,7 +3993,14 @@ class AnnotApp(QMainWindow):
         self.move(qr.topLeft())
 
     def closeEvent(self, event):
-        self.save_annotations_to_file()
+        self.session_timer.stop()
+        self.save_session()
+        if self.api:
+            self.api.stop()
+        with self.busy("Close"):
+            self.close_library()
+        if self.watchdog:
+            self.stop_watchdog()
         event.accept()
 
     def show_version_history(self, event):
@@ -643,12 +4008,25 @@ class AnnotApp(QMainWindow):
         dialog.exec_()
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    freeze_support()  # Lets the frozen executable start folder-import worker processes
+
+    parser = argparse.ArgumentParser(description="AnnotAPP")
+    parser.add_argument("--serve", metavar="XLSX", help="serve this workbook through the local API without the GUI")
+    parser.add_argument("--port", type=int, default=API_DEFAULT_PORT, help="local API port")
+    parser.add_argument("--startup-timeline", action="store_true",
+                        help="print import, first-paint and fully-loaded times once the library is loaded")
+    args, qt_args = parser.parse_known_args()
+    if args.serve:
+        serve_headless(args.serve, args.port)
+        sys.exit(0)
+
+    app = QApplication(sys.argv[:1] + qt_args)
     
     # Set the app icon
     app_icon = QIcon(icon_path)
     app.setWindowIcon(app_icon)
     
     window = AnnotApp()
+    window.print_startup_timeline = args.startup_timeline
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,61 @@
+""" Memory per annotation for AnnotationRecord versus plain dicts; run with: python bench_records.py [count] """
+import sys
+import time
+import hashlib
+import tracemalloc
+
+from AnnotAPP import AnnotationRecord
+
+
+def digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=12).digest()
+
+
+def parallel_dicts(names, bodies, now):
+    # Today's dict of strings, with the same metadata kept in dicts next to it
+    data = dict(zip(names, bodies))
+    created = {name: now + i for i, name in enumerate(names)}
+    modified = {name: now + i for i, name in enumerate(names)}
+    hashes = {name: digest(body).hex() for name, body in zip(names, bodies)}
+    return data, created, modified, hashes
+
+
+def dict_per_entry(names, bodies, now):
+    return {name: {'body': body, 'hash': digest(body), 'created': now + i, 'modified': now + i}
+            for i, (name, body) in enumerate(zip(names, bodies))}
+
+
+def records(names, bodies, now):
+    return {name: AnnotationRecord(body, now + i, now + i, digest(body))
+            for i, (name, body) in enumerate(zip(names, bodies))}
+
+
+def plain(names, bodies, now):
+    return dict(zip(names, bodies))
+
+
+def measure(build, names, bodies):
+    # Names and bodies exist beforehand, so only the container and metadata are counted
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(names, bodies, time.time())
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return used / len(names)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    names = [f"annotation {i}" for i in range(count)]
+    bodies = [f"Body of annotation {i}. " * 10 for i in range(count)]
+    print(f"{count:,} annotations, bytes per entry on top of name and body:")
+    for label, build in (("dict of str (no metadata)", plain),
+                         ("dict of str + parallel metadata dicts", parallel_dicts),
+                         ("dict of per-entry dicts", dict_per_entry),
+                         ("dict of AnnotationRecord", records)):
+        print(f"  {label:<40}{measure(build, names, bodies):8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+""" Local API checks against a stand-in client; run with: python -m unittest discover tests """
+import ctypes
+import http.client
+import json
+import os
+import sys
+import threading
+import types
+import unittest
+
+# AnnotAPP sets its taskbar id through windll when imported; elsewhere there is nothing to set
+if not hasattr(ctypes, 'windll'):
+    ctypes.windll = types.SimpleNamespace(shell32=types.SimpleNamespace(
+        SetCurrentProcessExplicitAppUserModelID=lambda app_id: None))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AnnotAPP import AnnotationApi, AnnotationStore, content_hash
+
+
+class AnnotationApiTest(unittest.TestCase):
+    def setUp(self):
+        self.store = AnnotationStore()
+        self.store.set("greeting", "Hello")
+        self.store.set("farewell", "Goodbye")
+        lock = threading.Lock()
+
+        def dispatch(fn):
+            with lock:
+                return fn()
+
+        self.api = AnnotationApi(lambda: self.store, dispatch, port=0)
+        self.api.start()
+        self.addCleanup(self.api.stop)
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.api.port, timeout=5)
+        self.addCleanup(connection.close)
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, data, headers)
+        response = connection.getresponse()
+        payload = response.read()
+        return response.status, response.getheader('ETag'), json.loads(payload) if payload else None
+
+    def test_get_returns_etag_and_304_when_unchanged(self):
+        status, etag, payload = self.request("GET", "/annotations/greeting")
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['annotation'], "Hello")
+        self.assertEqual(etag, f'"{content_hash("Hello")}"')
+        status, _, payload = self.request("GET", "/annotations/greeting", headers={'If-None-Match': etag})
+        self.assertEqual(status, 304)
+        self.assertIsNone(payload)
+
+    def test_collection_etag_changes_with_the_store(self):
+        _, etag, payload = self.request("GET", "/annotations")
+        self.assertEqual(sorted(payload['names']), ["farewell", "greeting"])
+        self.assertEqual(self.request("GET", "/annotations", headers={'If-None-Match': etag})[0], 304)
+        self.store.set("new", "text")
+        self.assertEqual(self.request("GET", "/annotations", headers={'If-None-Match': etag})[0], 200)
+
+    def test_put_honours_if_match(self):
+        _, etag, _ = self.request("GET", "/annotations/greeting")
+        status, new_etag, _ = self.request("PUT", "/annotations/greeting", {'annotation': "Hi"}, {'If-Match': etag})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.store["greeting"], "Hi")
+        # The old ETag no longer matches, so a second writer is refused
+        status, current, payload = self.request("PUT", "/annotations/greeting", {'annotation': "Hey"}, {'If-Match': etag})
+        self.assertEqual(status, 412)
+        self.assertEqual(current, new_etag)
+        self.assertEqual(self.store["greeting"], "Hi")
+        self.assertEqual(self.request("PUT", "/annotations/created", {'annotation': "x"})[0], 201)
+        self.assertEqual(self.request("PUT", "/annotations/created", {'text': "x"})[0], 400)
+
+    def test_batch_skips_unchanged_and_reports_missing(self):
+        _, etag, _ = self.request("GET", "/annotations/greeting")
+        status, _, payload = self.request("POST", "/batch", {'names': {'greeting': etag, 'farewell': None, 'nope': None}})
+        self.assertEqual(status, 200)
+        self.assertEqual(payload['unchanged'], ["greeting"])
+        self.assertEqual(payload['annotations']['farewell']['annotation'], "Goodbye")
+        self.assertEqual(payload['missing'], ["nope"])
+        status, _, payload = self.request("POST", "/batch", {'names': ["greeting"]})
+        self.assertEqual(payload['annotations']['greeting']['annotation'], "Hello")
+
+    def test_rejects_foreign_hosts(self):
+        self.assertEqual(self.request("GET", "/annotations", headers={'Host': 'evil.example'})[0], 403)
+
+
+if __name__ == '__main__':
+    unittest.main()